@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import os
+from collections import OrderedDict
+
+#~~~~~~~~~~~~~~GLOBALS~~~~~~~~~~~~~~#
+MIN_SORT_MEM_MB = 64
+DEFAULT_SORT_MEM_MB = 768
+VIEW_MEM_MB = 100
+
+#~~~~~~~~~~~~~~FUNCTIONS~~~~~~~~~~~~~~#
+
+def get_path_size_mb (path):
+    """ Size of a file or of all files in a directory in MB """
+    if os.path.isdir(path):
+        size = sum(os.path.getsize(os.path.join(root, fn)) for root, _, fn_list in os.walk(path) for fn in fn_list)
+    else:
+        size = os.path.getsize(path)
+    return size/1024/1024
+
+def allocate_pipeline (threads, mem_mb=0, aligner_mem_mb=None, view=True, n_sorts=1, log_fn=None):
+    """
+    Split the threads and memory granted to a job between an aligner and the samtools view and sort steps it is piped
+    into. Each samtools process counts for one main thread plus its additional threads (-@). Each samtools step gets up
+    to a quarter of the threads and the aligner gets the rest, so that the number of compute threads does not exceed
+    the grant. The aligner always gets at least one thread, so a grant smaller than the number of processes in the
+    pipeline is oversubscribed. The sort memory per thread (-m) is what is left of mem_mb after the aligner memory and
+    a margin for view, divided between the sort threads. Returns an OrderedDict with align_threads, view_threads,
+    sort_threads and sort_mem_mb. If the stream is sorted by several samtools sort processes, the threads and memory
+    of the sort step are shared between them and the returned values are per process.
+    * threads
+        Number of threads granted to the job
+    * mem_mb
+        Memory granted to the job in MB. If 0 the samtools default of 768MB per thread is used
+    * aligner_mem_mb
+        Estimated peak memory of the aligner in MB. Half of mem_mb is reserved for it if None
+    * view
+        If False there is no samtools view step
+    * n_sorts
+        Number of samtools sort processes running concurrently
+    * log_fn
+        Log file where to append the chosen split
+    """
+    threads = max(int(threads), 1)
+    n_sorts = max(int(n_sorts), 1)
+    # Each samtools step gets up to a quarter of the threads including the main thread of its processes
+    main_threads = n_sorts+(1 if view else 0)
+    step_threads = threads//4
+    view_threads = max(step_threads-1, 0) if view else 0
+    sort_threads = max(step_threads-n_sorts, 0)//n_sorts
+    align_threads = max(threads-main_threads-view_threads-sort_threads*n_sorts, 1)
+
+    mem_mb = int(mem_mb) if mem_mb else 0
+    if mem_mb:
+        if aligner_mem_mb is None:
+            aligner_mem_mb = mem_mb/2
+        # Keep 20% headroom as samtools sort slightly exceeds -m
+        sort_mem_mb = int((mem_mb-aligner_mem_mb-(VIEW_MEM_MB if view else 0))*0.8/(sort_threads+1)/n_sorts)
+        sort_mem_mb = max(sort_mem_mb, MIN_SORT_MEM_MB)
+    else:
+        sort_mem_mb = DEFAULT_SORT_MEM_MB
+
+    alloc = OrderedDict()
+    alloc["align_threads"] = align_threads
+    alloc["view_threads"] = view_threads
+    alloc["sort_threads"] = sort_threads
+    alloc["sort_mem_mb"] = sort_mem_mb
+    if log_fn:
+        with open(str(log_fn), "a") as log_fp:
+            log_fp.write(f"Resources granted: {threads} threads, {mem_mb} MB\n")
+            if aligner_mem_mb:
+                log_fp.write(f"Estimated aligner memory: {int(aligner_mem_mb)} MB\n")
+            log_fp.write("Allocation: {}\n".format(", ".join(f"{k}={v}" for k, v in alloc.items())))
+            if align_threads+main_threads+view_threads+sort_threads*n_sorts > threads:
+                log_fp.write("Warning: thread grant is too small for the number of processes in the pipeline\n")
+            if mem_mb and (aligner_mem_mb+sort_mem_mb*(sort_threads+1)*n_sorts > mem_mb):
+                log_fp.write("Warning: memory grant is too small for the aligner and the minimal sort buffers\n")
+    return alloc
+
+def allocate_star_sort (mem_mb, index_dir, log_fn=None):
+    """
+    Memory available to STAR for coordinate sorting (--limitBAMsortRAM) in bytes: what is left of mem_mb after loading
+    the genome index, with 20% headroom. Returns 0 (STAR default) if mem_mb is unknown or too small
+    """
+    mem_mb = int(mem_mb) if mem_mb else 0
+    index_mb = get_path_size_mb(index_dir)
+    sort_mem_mb = int((mem_mb-index_mb)*0.8) if mem_mb else 0
+    sort_mem = sort_mem_mb*1024*1024 if sort_mem_mb > 0 else 0
+    if log_fn:
+        with open(str(log_fn), "a") as log_fp:
+            log_fp.write(f"Resources granted: {mem_mb} MB / STAR index size: {int(index_mb)} MB\n")
+            log_fp.write(f"Allocation: limitBAMsortRAM={sort_mem}\n")
+    return sort_mem
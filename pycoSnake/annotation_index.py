@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import os
+import json
+
+# Third party lib
+import numpy as np
+import pandas as pd
+
+#~~~~~~~~~~~~~~GLOBALS~~~~~~~~~~~~~~#
+FEATURES = ["gene", "transcript", "exon", "tss"]
+FIELDS = ["start", "end", "strand", "id", "parent"]
+INDEX_VERSION = 1
+
+#~~~~~~~~~~~~~~FUNCTIONS~~~~~~~~~~~~~~#
+
+def build_annotation_index (gff3_fn, index_dir):
+    """
+    Parse a GFF3 annotation file once and save genes, transcripts, exons and transcription start sites in a binary
+    index directory that can be memory-mapped with AnnotationIndex. For each feature type, coordinates, strand, id and
+    parent id are stored as numpy arrays sorted by contig and start, and index.json records where each contig starts
+    and ends in the arrays together with the longest feature of the contig. Coordinates are 1-based and inclusive as
+    in the GFF3 file.
+    * gff3_fn
+        GFF3 annotation file (plain or gzipped)
+    * index_dir
+        Output directory
+    """
+    df = pd.read_csv(gff3_fn, sep="\t", comment="#", header=None, usecols=[0,2,3,4,6,8],
+        names=["contig", "type", "start", "end", "strand", "attributes"], dtype={"contig":str})
+    df["id"] = df["attributes"].str.extract(r"(?:^|;)ID=([^;]+)", expand=False)
+    df["parent"] = df["attributes"].str.extract(r"(?:^|;)Parent=([^;,]+)", expand=False)
+    df["strand"] = df["strand"].map({"+":1, "-":-1}).fillna(0).astype(np.int8)
+
+    # Classify features. Genes are top level features with a gene type and transcripts are their direct children
+    gene_mask = df["type"].str.contains("gene") & df["parent"].isna() & df["id"].notna()
+    transcript_mask = df["parent"].isin(df.loc[gene_mask, "id"]) & df["id"].notna()
+    feature_d = {
+        "gene": df[gene_mask],
+        "transcript": df[transcript_mask],
+        "exon": df[df["type"]=="exon"]}
+
+    # TSS are the 5' end of transcripts
+    tss_df = feature_d["transcript"].copy()
+    tss_df["start"] = np.where(tss_df["strand"]==-1, tss_df["end"], tss_df["start"])
+    tss_df["end"] = tss_df["start"]
+    feature_d["tss"] = tss_df
+
+    os.makedirs(index_dir, exist_ok=True)
+    meta = {"version":INDEX_VERSION, "features":{}}
+    for feature in FEATURES:
+        fdf = feature_d[feature].sort_values(["contig", "start", "end"], kind="mergesort")
+        fdf = fdf.fillna({"id":"", "parent":""})
+        for field in FIELDS:
+            if field in ["start", "end"]:
+                values = fdf[field].values.astype(np.int64)
+            elif field == "strand":
+                values = fdf[field].values.astype(np.int8)
+            else:
+                # Fixed width unicode arrays can be memory-mapped unlike object arrays
+                values = np.array(fdf[field].tolist(), dtype=str)
+            np.save(os.path.join(index_dir, f"{feature}_{field}.npy"), values)
+
+        # Contig boundaries in the sorted arrays
+        bounds_df = pd.DataFrame({"contig":fdf["contig"].values, "pos":np.arange(len(fdf)), "length":(fdf["end"]-fdf["start"]+1).values})
+        bounds_df = bounds_df.groupby("contig", sort=False).agg(lo=("pos", "min"), hi=("pos", "max"), max_len=("length", "max"))
+        meta["features"][feature] = {contig:[int(lo), int(hi)+1, int(max_len)] for contig, lo, hi, max_len in bounds_df.itertuples()}
+
+    with open(os.path.join(index_dir, "index.json"), "w") as fp:
+        json.dump(meta, fp)
+    return index_dir
+
+#~~~~~~~~~~~~~~CLASS~~~~~~~~~~~~~~#
+
+class AnnotationIndex ():
+    """
+    Query interface to an annotation index built with build_annotation_index. Arrays are memory-mapped and only loaded
+    when first used, so opening an index is instantaneous and only the pages of the queried contigs are read.
+    Coordinates are 1-based and inclusive.
+    * index_dir
+        Directory of the annotation index
+    * mmap
+        Memory-map the arrays instead of loading them in memory
+    """
+    def __init__ (self, index_dir, mmap=True):
+        self.index_dir = index_dir
+        self.mmap_mode = "r" if mmap else None
+        with open(os.path.join(index_dir, "index.json")) as fp:
+            meta = json.load(fp)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported annotation index version in {index_dir}")
+        self.meta = meta["features"]
+        self._arrays = {}
+
+    def __repr__ (self):
+        return "AnnotationIndex ({})".format(", ".join(f"{f}: {self.count(f)}" for f in FEATURES))
+
+    def contigs (self, feature="gene"):
+        """ List of contigs containing features of a given type """
+        return list(self.meta[feature].keys())
+
+    def count (self, feature="gene"):
+        """ Number of features of a given type """
+        return sum(hi-lo for lo, hi, _ in self.meta[feature].values())
+
+    def region (self, contig, start, end, feature="gene"):
+        """
+        Return a DataFrame of the features of a given type overlapping contig:start-end
+        * contig
+            Contig name
+        * start
+            Region start (1-based)
+        * end
+            Region end (inclusive)
+        * feature
+            One of gene, transcript, exon or tss
+        """
+        if not contig in self.meta[feature]:
+            return self._to_df(feature, contig, np.array([], dtype=np.int64))
+        lo, hi, max_len = self.meta[feature][contig]
+        starts = self._get(feature, "start")[lo:hi]
+        # Features overlapping the region start at most max_len before it
+        i = np.searchsorted(starts, start-max_len+1, side="left")
+        j = np.searchsorted(starts, end, side="right")
+        idx = np.arange(lo+i, lo+j)
+        idx = idx[self._get(feature, "end")[idx] >= start]
+        return self._to_df(feature, contig, idx)
+
+    def nearest_tss (self, contig, pos, n=1):
+        """
+        Return a DataFrame of the n transcription start sites closest to contig:pos with their signed distance to pos
+        (relative to the contig orientation)
+        * contig
+            Contig name
+        * pos
+            Position (1-based)
+        * n
+            Number of TSS to return
+        """
+        if not contig in self.meta["tss"]:
+            return self._to_df("tss", contig, np.array([], dtype=np.int64)).assign(distance=pd.Series(dtype=np.int64))
+        lo, hi, _ = self.meta["tss"][contig]
+        starts = self._get("tss", "start")[lo:hi]
+        i = np.searchsorted(starts, pos)
+        idx = np.arange(max(i-n, 0), min(i+n, hi-lo))
+        dist = starts[idx]-pos
+        idx = idx[np.argsort(np.abs(dist), kind="mergesort")[:n]]
+        df = self._to_df("tss", contig, lo+idx)
+        df["distance"] = df["start"].values-pos
+        return df
+
+    def _get (self, feature, field):
+        """ Lazily load or memory-map an array """
+        key = (feature, field)
+        if not key in self._arrays:
+            self._arrays[key] = np.load(os.path.join(self.index_dir, f"{feature}_{field}.npy"), mmap_mode=self.mmap_mode)
+        return self._arrays[key]
+
+    def _to_df (self, feature, contig, idx):
+        df = pd.DataFrame({field:np.asarray(self._get(feature, field)[idx]) for field in FIELDS})
+        df.insert(0, "contig", contig)
+        df["strand"] = df["strand"].map({1:"+", -1:"-", 0:"."})
+        return df
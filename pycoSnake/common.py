@@ -13,6 +13,14 @@ import inspect
 import pandas as pd
 from snakemake.logging import logger, setup_logger
 
+# Local imports
+from pycoSnake.ref_cache import get_cache_key, get_cache_entry, is_cached
+from pycoSnake.download import is_remote, get_remote_version
+
+#~~~~~~~~~~~~~~GLOBALS~~~~~~~~~~~~~~#
+# Rule parameters changing the prepared reference files. Resources and cluster settings are not part of the cache key
+REF_CACHE_PARAMS = ["opt", "include", "exclude", "min_length", "primary_only", "index"]
+
 #~~~~~~~~~~~~~~CUSTOM EXCEPTION CLASS~~~~~~~~~~~~~~#
 class pycoSnakeError (Exception):
     """ Basic exception class"""
@@ -128,6 +136,59 @@ def get_mem (config, rule_name, default=1000):
     except KeyError:
         return default
 
+def get_param (config, rule_name, param_name, default=None):
+    try:
+        return config[rule_name][param_name]
+    except (KeyError, TypeError):
+        return default
+
+def get_ref_cache (config, rule_name, source):
+    """
+    Return the shared reference cache entry for a source file prepared by rule_name and whether it is already
+    complete. The cache is enabled by setting `reference_cache` to a directory shared between projects. The entry is
+    keyed on the source URL or path, the rule parameters listed in REF_CACHE_PARAMS and the version of the source
+    file. The version is the `checksum` set in the rule config if any, otherwise the checksum published next to a
+    remote source or its size and modification time. Returns an empty entry if the cache is disabled or if the
+    version of a remote source cannot be determined.
+    """
+    cache_dir = config.get("reference_cache", "")
+    if not cache_dir:
+        return "", False
+    rule_config = config.get(rule_name) or {}
+    opt = {k:v for k, v in rule_config.items() if k in REF_CACHE_PARAMS}
+    checksum = get_param(config, rule_name, "checksum", "")
+    if not checksum and is_remote(source):
+        checksum = get_remote_version(source)
+        if not checksum:
+            logger.warning(f"Cannot determine the version of {source}. Not using the reference cache for {rule_name}")
+            return "", False
+    key = get_cache_key(source, rule_name, opt, checksum)
+    entry_dir = get_cache_entry(cache_dir, rule_name, key)
+    return entry_dir, is_cached(entry_dir)
+
+def get_fai_shards (fai_fn, n_shards):
+    """
+    Group the contigs listed in a fasta index into at most n_shards lists of consecutive contigs with similar total
+    lengths. Contigs order is preserved within and between shards so that shard results can be gathered in order.
+    Empty shards are dropped when there are fewer contigs than shards or when a contig is larger than a shard.
+    """
+    contig_list = []
+    with open(fai_fn) as fp:
+        for line in fp:
+            name, length = line.split("\t")[:2]
+            contig_list.append((name, int(length)))
+
+    n_shards = max(int(n_shards), 1)
+    total = sum(length for _, length in contig_list)
+    shard_list = [[] for _ in range(n_shards)]
+    cum_length = 0
+    for name, length in contig_list:
+        # Assign contig to shard containing its midpoint
+        shard = min(int((cum_length+length/2)*n_shards/total), n_shards-1) if total else 0
+        shard_list[shard].append(name)
+        cum_length += length
+    return [shard for shard in shard_list if shard]
+
 #~~~~~~~~~~~~~~MAIN HELPER FUNCTIONS~~~~~~~~~~~~~~#
 
 def add_argument_group (parser, title):
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import os
+import json
+import resource
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party lib
+import numpy as np
+import pandas as pd
+
+#~~~~~~~~~~~~~~FUNCTIONS~~~~~~~~~~~~~~#
+
+def get_sample_id (fn):
+    """ Sample id from a per sample count file name """
+    return os.path.basename(fn).rpartition(".")[0]
+
+def read_samples (fn_list, read_func, threads=1):
+    """
+    Parse per sample files in parallel with read_func and return an OrderedDict of sample_id:DataFrame
+    in the same order as fn_list
+    """
+    with ThreadPoolExecutor(max_workers=max(int(threads), 1)) as executor:
+        df_list = list(executor.map(read_func, fn_list))
+    return OrderedDict(zip([get_sample_id(fn) for fn in fn_list], df_list))
+
+def compact_dtypes (df):
+    """
+    Downcast the whole matrix to int32 if all values are integers in range or to float32 otherwise. This is lossy for
+    non-integral values and is only meant for in-memory or columnar matrices
+    """
+    values = df.values
+    if np.issubdtype(values.dtype, np.number) and values.size:
+        if np.array_equal(values, np.round(values)) and values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max:
+            return df.astype(np.int32)
+        return df.astype(np.float32)
+    return df
+
+def build_matrix (sample_dict, col=None, fill_value=0, compact=False):
+    """
+    Build a sample matrix from an OrderedDict of sample_id:DataFrame in a single concatenation.
+    The union of all indexes is computed once and sorted. Missing values are filled with fill_value unless it is None.
+    * sample_dict
+        OrderedDict of sample_id:DataFrame (or Series if col is None)
+    * col
+        Name of the column to extract from each DataFrame
+    * compact
+        Downcast the matrix with compact_dtypes
+    """
+    series_list = []
+    for sample_id, sample_df in sample_dict.items():
+        s = sample_df if col is None else sample_df[col]
+        series_list.append(s.rename(sample_id))
+    if not series_list:
+        return pd.DataFrame()
+    df = pd.concat(series_list, axis=1, sort=True, copy=False)
+    if fill_value is not None:
+        df = df.fillna(fill_value)
+    if compact:
+        df = compact_dtypes(df)
+    return df
+
+def merge_samples (fn_list, read_func, col_list, threads=1, cache_dir=None, log_fn=None):
+    """
+    Merge the columns listed in col_list from all the per sample files into one matrix per column and return an
+    OrderedDict of col:matrix. If a cache_dir is given, the unfilled matrices are saved in it together with a
+    manifest of the input files (mtime and size) and on the next call only new or modified files are parsed and
+    patched into the cached matrices. Samples that are no longer in fn_list are removed.
+    * fn_list
+        List of per sample files
+    * read_func
+        Function parsing a sample file into a DataFrame containing the columns in col_list
+    * col_list
+        List of columns to merge
+    * threads
+        Number of files to parse in parallel
+    * cache_dir
+        Directory where to keep the merged matrices and the manifest between runs
+    * log_fn
+        Log file where to append the list of files parsed
+    """
+    sample_id_list = [get_sample_id(fn) for fn in fn_list]
+    stat_d = OrderedDict()
+    for fn, sample_id in zip(fn_list, sample_id_list):
+        st = os.stat(fn)
+        stat_d[os.path.abspath(fn)] = {"sample_id":sample_id, "mtime":st.st_mtime, "size":st.st_size}
+
+    # Load manifest and cached matrices if they are compatible with the current merge
+    manifest = {}
+    cached_d = {}
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        manifest_fn = os.path.join(cache_dir, "manifest.json")
+        try:
+            with open(manifest_fn) as fp:
+                manifest = json.load(fp)
+            if manifest.get("cols") != list(col_list):
+                raise ValueError("Cached columns differ")
+            for col in col_list:
+                cached_d[col] = pd.read_pickle(os.path.join(cache_dir, f"{col}.pkl"))
+        except (IOError, OSError, ValueError, KeyError):
+            manifest = {}
+            cached_d = {}
+
+    # Find new or modified files and cached samples to remove
+    cached_files = manifest.get("files", {})
+    update_list = [fn for fn in fn_list if cached_files.get(os.path.abspath(fn)) != stat_d[os.path.abspath(fn)]]
+    keep_set = {v["sample_id"] for k, v in cached_files.items() if stat_d.get(k) == v}
+    if log_fn:
+        with open(str(log_fn), "a") as log_fp:
+            log_fp.write(f"Parsing {len(update_list)} new or modified files out of {len(fn_list)}\n")
+
+    # Invalidate manifest before updating the cached matrices
+    if cache_dir and os.path.isfile(manifest_fn):
+        os.remove(manifest_fn)
+
+    # Parse only required files and patch cached matrices
+    sample_dict = read_samples(update_list, read_func, threads)
+    matrix_d = OrderedDict()
+    for col in col_list:
+        df = build_matrix(sample_dict, col, fill_value=None, compact=False)
+        if col in cached_d:
+            cached_df = cached_d[col]
+            cached_df = cached_df[[sample_id for sample_id in cached_df.columns if sample_id in keep_set]]
+            df = pd.concat([cached_df, df], axis=1, sort=True, copy=False)
+            # Drop rows that were only found in removed or modified samples
+            df = df.dropna(how="all")
+        df = df.reindex(columns=sample_id_list)
+        if cache_dir:
+            df.to_pickle(os.path.join(cache_dir, f"{col}.pkl"))
+        matrix_d[col] = df.fillna(0)
+
+    # Write manifest last so that an interrupted merge triggers a full rebuild next time
+    if cache_dir:
+        with open(manifest_fn+".tmp", "w") as fp:
+            json.dump({"cols":list(col_list), "files":stat_d}, fp)
+        os.replace(manifest_fn+".tmp", manifest_fn)
+    return matrix_d
+
+def get_peak_memory ():
+    """ Peak resident memory of the current process in MB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def log_matrix (df, name, log_fn):
+    """ Append matrix shape, dtype and process peak memory to log file """
+    with open(str(log_fn), "a") as log_fp:
+        dtype = df.dtypes.iloc[0] if df.shape[1] else None
+        log_fp.write(f"{name}: {df.shape[0]} rows x {df.shape[1]} samples ({dtype})\n")
+        log_fp.write(f"Peak memory: {get_peak_memory():.1f} MB\n")
+
+def write_matrix (df, fn, sep="\t", compact=False):
+    """
+    Write matrix in a format depending on the file extension:
+    * .parquet: typed and compressed columnar Parquet file (requires pyarrow)
+    * .feather: typed and uncompressed columnar Feather file that can be memory-mapped (requires pyarrow)
+    * .npz: sparse compressed numpy archive of the non-zero values, for zero-heavy matrices
+    * Any other extension: tabulated text file
+    If compact is True, matrices written in one of the binary formats are downcast with compact_dtypes first. Text
+    files are always written at full precision
+    """
+    fn = str(fn)
+    if compact and fn.endswith((".parquet", ".feather", ".npz")):
+        df = compact_dtypes(df)
+    if fn.endswith(".parquet"):
+        df.to_parquet(fn, engine="pyarrow", compression="snappy")
+    elif fn.endswith(".feather"):
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        # Feather does not support indexes so store it as the first column
+        feather.write_feather(pa.Table.from_pandas(df.reset_index(), preserve_index=False), fn, compression="uncompressed")
+    elif fn.endswith(".npz"):
+        # Store non-zero values in Compressed Sparse Column format
+        values = df.values
+        col_nz = [np.flatnonzero(values[:,i]) for i in range(values.shape[1])]
+        indices = np.concatenate(col_nz).astype(np.int32) if col_nz else np.array([], dtype=np.int32)
+        indptr = np.cumsum([0]+[len(nz) for nz in col_nz]).astype(np.int64)
+        data = np.concatenate([values[nz,i] for i, nz in enumerate(col_nz)]) if col_nz else np.array([], dtype=values.dtype)
+        np.savez_compressed(fn,
+            data=data, indices=indices, indptr=indptr, shape=np.array(values.shape),
+            index=np.array(df.index, dtype=str), columns=np.array(df.columns, dtype=str),
+            index_name=np.array(df.index.name or "", dtype=str))
+    else:
+        df.to_csv(fn, sep=sep)
+
+def read_matrix (fn, sep="\t"):
+    """ Read a matrix written with write_matrix. Feather files are memory-mapped """
+    fn = str(fn)
+    if fn.endswith(".parquet"):
+        return pd.read_parquet(fn, engine="pyarrow")
+    elif fn.endswith(".feather"):
+        import pyarrow.feather as feather
+        df = feather.read_table(fn, memory_map=True).to_pandas()
+        return df.set_index(df.columns[0])
+    elif fn.endswith(".npz"):
+        with np.load(fn) as npz:
+            n_rows, n_cols = npz["shape"]
+            values = np.zeros((n_rows, n_cols), dtype=npz["data"].dtype)
+            indices, indptr, data = npz["indices"], npz["indptr"], npz["data"]
+            for i in range(n_cols):
+                values[indices[indptr[i]:indptr[i+1]], i] = data[indptr[i]:indptr[i+1]]
+            index = pd.Index(npz["index"], name=str(npz["index_name"]) or None)
+            return pd.DataFrame(values, index=index, columns=npz["columns"])
+    else:
+        return pd.read_csv(fn, sep=sep, index_col=0)
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import os
+import time
+import shutil
+import ftplib
+import hashlib
+import subprocess
+import urllib.request
+import urllib.error
+import http.client
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+#~~~~~~~~~~~~~~GLOBALS~~~~~~~~~~~~~~#
+BUFFER_SIZE = 1024*1024
+MIN_PART_SIZE = 50*1024*1024
+CHECKSUM_FILES = ["CHECKSUMS", "MD5SUM"]
+# Network errors worth another attempt
+RETRY_ERRORS = ftplib.all_errors + (http.client.HTTPException,)
+
+#~~~~~~~~~~~~~~CUSTOM EXCEPTION CLASS~~~~~~~~~~~~~~#
+class DownloadError (IOError):
+    """ Raised when a file cannot be downloaded or fails checksum verification """
+    pass
+
+#~~~~~~~~~~~~~~FUNCTIONS~~~~~~~~~~~~~~#
+
+def is_remote (url):
+    """ True if url has to be downloaded """
+    return str(url).startswith(("ftp://", "http://", "https://"))
+
+def download_file (url, dest, n_parts=4, retries=5, timeout=60, verify=True, log_fn=None):
+    """
+    Download url to dest and return dest. Partial downloads are kept next to dest and resumed on the next attempt or
+    call. If the server reports the file size and supports byte ranges (HTTP Range or FTP REST), files larger than
+    MIN_PART_SIZE are fetched as n_parts ranges in parallel. If the server directory contains an Ensembl style
+    CHECKSUMS (BSD sum) or MD5SUM file listing the file, the download is verified against it.
+    * url
+        HTTP(S) or FTP URL
+    * dest
+        Destination file path
+    * n_parts
+        Maximal number of ranges to download in parallel
+    * retries
+        Number of attempts for each range. Each new attempt resumes from the data already downloaded
+    * timeout
+        Connection timeout in seconds
+    * verify
+        Verify the downloaded file against the checksums published by the server if available
+    * log_fn
+        Log file where to append download information
+    """
+    dest = str(dest)
+    if os.path.isfile(dest):
+        _log(log_fn, f"{dest} already downloaded")
+        return dest
+
+    size, ranges = get_remote_info(url, timeout, retries, log_fn)
+    _log(log_fn, f"Downloading {url} (size: {size}, ranges: {ranges})")
+
+    # Define ranges to download in parallel
+    n_parts = max(int(n_parts), 1)
+    if size and ranges and size > MIN_PART_SIZE and n_parts > 1:
+        part_size = -(-size//n_parts)
+        part_list = [(f"{dest}.part{i}", start, min(start+part_size, size)) for i, start in enumerate(range(0, size, part_size))]
+    else:
+        part_list = [(f"{dest}.part0", 0, size)]
+
+    # Download all ranges and concatenate them
+    t = time.time()
+    with ThreadPoolExecutor(max_workers=len(part_list)) as executor:
+        list(executor.map(lambda part: _fetch_part_retry(url, *part, retries, timeout, log_fn), part_list))
+    with open(part_list[0][0], "ab") as fp:
+        for part_fn, _, _ in part_list[1:]:
+            with open(part_fn, "rb") as part_fp:
+                shutil.copyfileobj(part_fp, fp, BUFFER_SIZE)
+            os.remove(part_fn)
+    if size and os.path.getsize(part_list[0][0]) != size:
+        os.remove(part_list[0][0])
+        raise DownloadError(f"Incomplete download for {url}")
+    _log(log_fn, f"Downloaded {url} in {time.time()-t:.1f}s")
+
+    # Verify download before moving it to its final destination
+    if verify:
+        verify_checksum(url, part_list[0][0], timeout, log_fn, retries)
+    os.replace(part_list[0][0], dest)
+    return dest
+
+def download_to_dir (url, outdir, **kwargs):
+    """ Download url in outdir with download_file, keeping the remote file name, and return the local file path """
+    os.makedirs(outdir, exist_ok=True)
+    return download_file(url, os.path.join(outdir, os.path.basename(urlparse(url).path)), **kwargs)
+
+def get_remote_info (url, timeout=60, retries=5, log_fn=None):
+    """ Return the size of the remote file (None if unknown) and whether byte ranges are supported """
+    size, ranges, _ = _retry(lambda: _get_remote_stat(url, timeout), retries, log_fn, url)
+    return size, ranges
+
+def get_remote_version (url, timeout=60, retries=5):
+    """
+    Identify the version of the remote file without downloading it. Return the checksum published by the server if
+    available, or its size and modification time otherwise. Return an empty string if none of them is known
+    """
+    remote_checksum = get_remote_checksum(url, timeout, retries)
+    if remote_checksum:
+        return "{}:{}".format(*remote_checksum)
+    size, _, mtime = _retry(lambda: _get_remote_stat(url, timeout), retries, None, url)
+    if size is None and not mtime:
+        return ""
+    return f"{size}:{mtime}"
+
+def get_remote_checksum (url, timeout=60, retries=5, log_fn=None):
+    """
+    Look for the checksum of url in the checksum files published in the same directory.
+    Return a (method, checksum) tuple or None if not available
+    """
+    base_url, _, fn = url.rpartition("/")
+    for checksum_fn in CHECKSUM_FILES:
+        try:
+            text = fetch_text(f"{base_url}/{checksum_fn}", timeout, retries, log_fn)
+        except ftplib.all_errors:
+            continue
+        for line in text.splitlines():
+            fields = line.split()
+            if len(fields) >= 2 and fields[-1] == fn:
+                if checksum_fn == "MD5SUM":
+                    return ("md5", fields[0])
+                elif len(fields) == 3:
+                    return ("sum", f"{int(fields[0])} {int(fields[1])}")
+    return None
+
+def verify_checksum (url, fn, timeout=60, log_fn=None, retries=5):
+    """ Verify fn against the checksum published for url. Raise DownloadError and remove fn if it does not match """
+    remote_checksum = get_remote_checksum(url, timeout, retries, log_fn)
+    if not remote_checksum:
+        _log(log_fn, f"No published checksum found for {url}")
+        return
+    method, expected = remote_checksum
+    observed = bsd_sum(fn) if method == "sum" else md5sum(fn)
+    if observed != expected:
+        os.remove(fn)
+        raise DownloadError(f"Checksum mismatch for {url}: expected {expected}, found {observed}")
+    _log(log_fn, f"Verified {method} checksum for {url}: {observed}")
+
+def fetch_text (url, timeout=60, retries=5, log_fn=None):
+    """ Download a small text file in memory. Raise DownloadError if the file does not exist """
+    return _retry(lambda: _fetch_text(url, timeout), retries, log_fn, url)
+
+def bsd_sum (fn):
+    """ BSD sum checksum and number of 1kb blocks of a file, as published in Ensembl CHECKSUMS files """
+    try:
+        out = subprocess.run(["sum", "-r", fn], stdout=subprocess.PIPE, check=True).stdout.decode().split()
+        return f"{int(out[0])} {int(out[1])}"
+    except (OSError, subprocess.CalledProcessError):
+        # Slow pure python fallback if sum is not available
+        checksum = size = 0
+        with open(fn, "rb") as fp:
+            for buf in iter(lambda: fp.read(BUFFER_SIZE), b""):
+                size += len(buf)
+                for byte in buf:
+                    checksum = ((checksum >> 1) + ((checksum & 1) << 15) + byte) & 0xffff
+        return f"{checksum} {-(-size//1024)}"
+
+def md5sum (fn):
+    """ md5 checksum of a file """
+    h = hashlib.md5()
+    with open(fn, "rb") as fp:
+        for buf in iter(lambda: fp.read(BUFFER_SIZE), b""):
+            h.update(buf)
+    return h.hexdigest()
+
+#~~~~~~~~~~~~~~PRIVATE FUNCTIONS~~~~~~~~~~~~~~#
+
+def _retry (func, retries, log_fn, desc):
+    """ Call func with exponential backoff between attempts on network errors. DownloadError is raised directly """
+    for attempt in range(retries):
+        try:
+            return func()
+        except DownloadError:
+            raise
+        except RETRY_ERRORS as E:
+            if attempt == retries-1:
+                raise DownloadError(f"Failed to download {desc} after {retries} attempts: {E}")
+            _log(log_fn, f"Attempt {attempt+1} failed for {desc} ({E}). Retrying")
+            time.sleep(2**attempt)
+
+def _get_remote_stat (url, timeout):
+    """ Return the size (None if unknown), byte range support and modification time (empty if unknown) of url """
+    if urlparse(url).scheme == "ftp":
+        ftp, path = _ftp_connect(url, timeout)
+        try:
+            try:
+                size = ftp.size(path)
+            except ftplib.error_perm:
+                return None, False, ""
+            # REST support is part of the FEAT list of most servers but try it directly to be sure
+            try:
+                ftp.sendcmd("REST 0")
+                ranges = True
+            except (ftplib.error_reply, ftplib.error_temp, ftplib.error_perm):
+                ranges = False
+            try:
+                mtime = ftp.sendcmd(f"MDTM {path}").split()[-1]
+            except (ftplib.error_reply, ftplib.error_temp, ftplib.error_perm):
+                mtime = ""
+            return size, ranges, mtime
+        finally:
+            _ftp_close(ftp)
+    else:
+        req = urllib.request.Request(url, method="HEAD")
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                size = resp.headers.get("Content-Length")
+                ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+                mtime = resp.headers.get("Last-Modified", "")
+                return (int(size) if size else None), ranges, mtime
+        except urllib.error.HTTPError as E:
+            # Server errors are retried but HEAD requests may not be allowed at all
+            if E.code >= 500:
+                raise
+            return None, False, ""
+
+def _fetch_text (url, timeout):
+    """ Single attempt of fetch_text """
+    if urlparse(url).scheme == "ftp":
+        ftp, path = _ftp_connect(url, timeout)
+        buf = []
+        try:
+            ftp.retrbinary(f"RETR {path}", buf.append)
+        except ftplib.error_perm as E:
+            raise DownloadError(f"Cannot fetch {url}: {E}")
+        finally:
+            _ftp_close(ftp)
+        return b"".join(buf).decode()
+    else:
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as resp:
+                return resp.read().decode()
+        except urllib.error.HTTPError as E:
+            if E.code >= 500:
+                raise
+            raise DownloadError(f"Cannot fetch {url}: {E}")
+
+def _fetch_part_retry (url, part_fn, start, end, retries, timeout, log_fn):
+    """ Fetch a range with exponential backoff between attempts. Each attempt resumes from the data already fetched """
+    return _retry(lambda: _fetch_part(url, part_fn, start, end, timeout), retries, log_fn, f"{url} ({part_fn})")
+
+def _fetch_part (url, part_fn, start, end, timeout):
+    """ Download bytes start to end (excluded, or until EOF if end is None) of url, resuming from existing part_fn """
+    done = os.path.getsize(part_fn) if os.path.isfile(part_fn) else 0
+    if end is not None and start+done >= end:
+        return
+    remaining = None if end is None else end-start-done
+
+    if urlparse(url).scheme == "ftp":
+        ftp, path = _ftp_connect(url, timeout)
+        try:
+            conn = ftp.transfercmd(f"RETR {path}", rest=start+done or None)
+            with conn, open(part_fn, "ab") as fp:
+                remaining = _copy_stream(conn.makefile("rb"), fp, remaining)
+            # Only wait for the end of transfer if the whole file was read
+            if end is None:
+                ftp.voidresp()
+        finally:
+            _ftp_close(ftp)
+    else:
+        req = urllib.request.Request(url)
+        if start+done or end is not None:
+            req.add_header("Range", f"bytes={start+done}-{'' if end is None else end-1}")
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            # Restart from scratch if the server ignored the range request
+            if resp.status != 206 and start+done:
+                if start:
+                    raise DownloadError(f"Server ignored range request for {url}")
+                os.remove(part_fn)
+                remaining = end
+            with open(part_fn, "ab") as fp:
+                remaining = _copy_stream(resp, fp, remaining)
+    if remaining:
+        raise IOError(f"Connection closed with {remaining} bytes left")
+
+def _copy_stream (src, dest, remaining=None):
+    """ Copy src to dest up to remaining bytes or until EOF and return the number of bytes left """
+    while remaining is None or remaining > 0:
+        buf = src.read(BUFFER_SIZE if remaining is None else min(BUFFER_SIZE, remaining))
+        if not buf:
+            break
+        dest.write(buf)
+        if remaining is not None:
+            remaining -= len(buf)
+    return remaining
+
+def _ftp_connect (url, timeout):
+    """ Open a binary mode FTP connection and return it with the path of the file """
+    p = urlparse(url)
+    ftp = ftplib.FTP(timeout=timeout)
+    ftp.connect(p.hostname, p.port or 21)
+    ftp.login(p.username or "anonymous", p.password or "")
+    ftp.voidcmd("TYPE I")
+    return ftp, p.path
+
+def _ftp_close (ftp):
+    """ Close FTP connection without waiting for aborted transfers """
+    try:
+        ftp.quit()
+    except ftplib.all_errors:
+        ftp.close()
+
+def _log (log_fn, msg):
+    if log_fn:
+        with open(str(log_fn), "a") as log_fp:
+            log_fp.write(msg+"\n")
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import re
+import gzip
+import subprocess
+
+#~~~~~~~~~~~~~~GLOBALS~~~~~~~~~~~~~~#
+BUFFER_SIZE = 1024*1024
+
+#~~~~~~~~~~~~~~FUNCTIONS~~~~~~~~~~~~~~#
+
+def open_fasta (fn):
+    """ Open a plain or gzipped fasta file for streaming in binary mode """
+    fn = str(fn)
+    if fn.lower().endswith(".gz"):
+        return gzip.open(fn, "rb")
+    return open(fn, "rb", buffering=BUFFER_SIZE)
+
+def is_primary (header):
+    """
+    Check if an Ensembl fasta header belongs to the primary assembly. Ensembl headers contain a location field
+    coord_system:assembly:seq_region:start:end:strand. Unplaced scaffolds are on the scaffold coordinate system and
+    alternative haplotypes and patches are on seq_regions prefixed with CHR_. Headers without location are kept
+    """
+    for field in header.split()[1:]:
+        loc = field.split(":")
+        if len(loc) == 6:
+            return loc[0] == "chromosome" and not loc[2].startswith("CHR_")
+    return True
+
+#~~~~~~~~~~~~~~CLASS~~~~~~~~~~~~~~#
+
+class FastaWriter ():
+    """
+    Streaming fasta writer producing sequence lines of fixed width and the matching samtools fai index in a single pass.
+    Sequences are written in pieces with write so that memory usage does not depend on the record length.
+    If the output file name ends with .gz, the file is compressed with bgzip and a .gzi index is also generated.
+    Offsets in the fai index always refer to the uncompressed file as expected by samtools and htslib.
+    * fn
+        Output fasta file
+    * index_fn
+        Output fai index file
+    * line_width
+        Number of bases per line
+    * gzi_fn
+        Output gzi index file for bgzip compressed output (default fn.gzi)
+    * threads
+        Number of bgzip compression threads
+    """
+    def __init__ (self, fn, index_fn=None, line_width=60, gzi_fn=None, threads=1):
+        self.fn = str(fn)
+        self.index_fn = str(index_fn) if index_fn else self.fn+".fai"
+        self.line_width = int(line_width)
+        self.proc = None
+        if self.fn.lower().endswith(".gz"):
+            gzi_fn = str(gzi_fn) if gzi_fn else self.fn+".gzi"
+            self.out_fp = open(self.fn, "wb")
+            cmd = ["bgzip", "-c", "-@", str(threads), "-i", "-I", gzi_fn]
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=self.out_fp, bufsize=BUFFER_SIZE)
+            self.fp = self.proc.stdin
+        else:
+            self.fp = open(self.fn, "wb", buffering=BUFFER_SIZE)
+        self.index_list = []
+        self.offset = 0
+        self.name = None
+        self.length = 0
+        self.seq_offset = 0
+        self.pending = bytearray()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_record (self, name):
+        """ Start a new record """
+        self._end_record()
+        header = f">{name}\n".encode()
+        self.fp.write(header)
+        self.offset += len(header)
+        self.name = name
+        self.length = 0
+        self.seq_offset = self.offset
+
+    def write (self, seq):
+        """ Append a piece of sequence (bytes) to the current record and write all complete lines """
+        self.length += len(seq)
+        self.pending += seq
+        n = len(self.pending)//self.line_width*self.line_width
+        if n:
+            w = self.line_width
+            self.fp.write(b"\n".join(self.pending[i:i+w] for i in range(0, n, w))+b"\n")
+            self.offset += n+n//w
+            del self.pending[:n]
+
+    def close (self):
+        """ Flush the last record, close the output file and write the fai index """
+        if self.fp.closed:
+            return
+        self._end_record()
+        self.fp.close()
+        if self.proc:
+            if self.proc.wait():
+                raise IOError(f"bgzip failed with exit code {self.proc.returncode} while writing {self.fn}")
+            self.out_fp.close()
+        with open(self.index_fn, "w") as fp:
+            for line in self.index_list:
+                fp.write("\t".join(str(i) for i in line)+"\n")
+
+    def _end_record (self):
+        """ Write the last incomplete line of the current record and save its index entry """
+        if self.name is None:
+            return
+        if self.pending:
+            self.fp.write(self.pending+b"\n")
+            self.offset += len(self.pending)+1
+            self.pending = bytearray()
+        line_bases = min(self.length, self.line_width)
+        self.index_list.append([self.name, self.length, self.seq_offset, line_bases, line_bases+1])
+        self.name = None
+
+class ContigFilter ():
+    """
+    Streaming record filter sitting in front of a FastaWriter. Records are selected on their id with include and
+    exclude regular expressions, on their Ensembl location for primary_only and on their length. Only the first
+    min_length bases of a record are buffered until it is known to be long enough. The id, length and reason of
+    dropped records are saved and can be written to a manifest file.
+    * writer
+        FastaWriter where to write selected records
+    * include
+        Regular expression that record ids have to fully match to be kept
+    * exclude
+        Regular expression of record ids to drop
+    * min_length
+        Minimal record length
+    * primary_only
+        Only keep Ensembl primary assembly records (see is_primary)
+    """
+    def __init__ (self, writer, include="", exclude="", min_length=0, primary_only=False):
+        self.writer = writer
+        self.include = re.compile(include) if include else None
+        self.exclude = re.compile(exclude) if exclude else None
+        self.min_length = int(min_length) if min_length else 0
+        self.primary_only = primary_only
+        self.kept_list = []
+        self.dropped_list = []
+        self.name = None
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_record (self, header):
+        """ Start a new record from its header line without leading > """
+        self._end_record()
+        self.header = header
+        self.name = header.split(None, 1)[0]
+        self.length = 0
+        self.buffer = []
+        self.flushed = False
+        if self.include and not self.include.fullmatch(self.name):
+            self.reason = "include"
+        elif self.exclude and self.exclude.fullmatch(self.name):
+            self.reason = "exclude"
+        elif self.primary_only and not is_primary(header):
+            self.reason = "primary_only"
+        else:
+            self.reason = None
+
+    def write (self, seq):
+        """ Append a piece of sequence to the current record """
+        self.length += len(seq)
+        if self.reason:
+            return
+        if self.flushed:
+            self.writer.write(seq)
+        else:
+            self.buffer.append(seq)
+            if self.length >= self.min_length:
+                self._flush()
+
+    def close (self):
+        """ End the last record """
+        self._end_record()
+
+    def write_manifest (self, fn):
+        """ Write a tabulated file listing dropped records with the reason why they were dropped """
+        with open(str(fn), "w") as fp:
+            fp.write("id\tlength\treason\n")
+            for name, length, reason in self.dropped_list:
+                fp.write(f"{name}\t{length}\t{reason}\n")
+
+    def _flush (self):
+        self.writer.add_record(self.name)
+        for seq in self.buffer:
+            self.writer.write(seq)
+        self.buffer = []
+        self.flushed = True
+
+    def _end_record (self):
+        if self.name is None:
+            return
+        if not self.reason and not self.flushed:
+            if self.length >= self.min_length:
+                self._flush()
+            else:
+                self.reason = "min_length"
+        if self.reason:
+            self.dropped_list.append((self.name, self.length, self.reason))
+        else:
+            self.kept_list.append((self.header, self.length))
+        self.name = None
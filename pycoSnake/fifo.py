@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~GLOBALS~~~~~~~~~~~~~~#
+# Shell trap killing the background jobs left when a wrapper command exits
+KILL_JOBS_ON_EXIT = "trap 'kill $(jobs -p) 2>/dev/null || true' EXIT;"
+
+#~~~~~~~~~~~~~~FUNCTIONS~~~~~~~~~~~~~~#
+
+def fifo_guard (fifo):
+    """
+    Shell trap to set at the start of a subshell reading or writing a named pipe. When the subshell exits, the pipe is
+    opened in read-write mode, which never blocks, so that a peer already waiting in open gets an EOF or a broken pipe
+    if the process died before opening the pipe. The pipe is then replaced by an empty file so that a later open does
+    not block either. The failure is reported by wait instead of the job hanging. Use with KILL_JOBS_ON_EXIT in the
+    main shell
+    """
+    return f"trap 'exec 3<> {fifo}; : > {fifo}.tmp; mv -f {fifo}.tmp {fifo}; exec 3>&-' EXIT;"
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import os
+import json
+import time
+import shutil
+import hashlib
+import fcntl
+
+#~~~~~~~~~~~~~~FUNCTIONS~~~~~~~~~~~~~~#
+
+def get_cache_key (source, rule_name, opt="", checksum=""):
+    """
+    Build a cache key from the source URL or path, the rule preparing it, its options and the source checksum.
+    If no checksum is given for a local source file, its size and modification time are used instead
+    """
+    source = str(source)
+    if not checksum and os.path.isfile(source):
+        st = os.stat(source)
+        checksum = f"{st.st_size}:{st.st_mtime}"
+    key_str = json.dumps([source, rule_name, opt, checksum], sort_keys=True)
+    return hashlib.sha256(key_str.encode()).hexdigest()[:32]
+
+def get_content_key (fn_list, rule_name, opt="", version=""):
+    """
+    Build a cache key from the content of the input files, the rule preparing the output, its options and the version
+    of the tool used. Used for outputs derived from prepared files whose path is the same in every project
+    """
+    checksum_list = [file_checksum(str(fn)) for fn in fn_list]
+    return get_cache_key(" ".join(checksum_list), rule_name, opt, version)
+
+def get_cache_entry (cache_dir, rule_name, key):
+    """ Directory of a cache entry """
+    return os.path.join(os.path.abspath(cache_dir), rule_name, key)
+
+def is_cached (entry_dir):
+    """ An entry is complete once its manifest has been written """
+    return bool(entry_dir) and os.path.isfile(os.path.join(entry_dir, "manifest.json"))
+
+def file_checksum (fn, buffer_size=1024*1024):
+    """ md5 checksum of a file read by fixed size buffers """
+    h = hashlib.md5()
+    with open(fn, "rb") as fp:
+        for buf in iter(lambda: fp.read(buffer_size), b""):
+            h.update(buf)
+    return h.hexdigest()
+
+def store_file (src, dest):
+    """ Hardlink src to dest or copy it if src is on a different filesystem """
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+    return dest
+
+def link_file (src, dest):
+    """
+    Hardlink src to dest, or symlink if src is on a different filesystem.
+    Directories are recreated and the files they contain are linked individually
+    """
+    if os.path.isdir(src):
+        link_type = "hardlink"
+        for root, _, fn_list in os.walk(src):
+            dest_root = os.path.join(dest, os.path.relpath(root, src))
+            os.makedirs(dest_root, exist_ok=True)
+            for fn in fn_list:
+                link_type = link_file(os.path.join(root, fn), os.path.join(dest_root, fn))
+        return link_type
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+        os.utime(dest)
+        return "hardlink"
+    except OSError:
+        os.symlink(os.path.abspath(src), dest)
+        os.utime(dest, follow_symlinks=False)
+        return "symlink"
+
+#~~~~~~~~~~~~~~CLASS~~~~~~~~~~~~~~#
+
+class RefCache ():
+    """
+    Context manager sharing prepared reference files between projects. The entry is locked while in use so that
+    concurrent projects do not race. If the entry is complete, output files are linked from the cache and the
+    context value is True. Otherwise it is False, the outputs have to be generated within the context and they are
+    saved in the cache on exit. If no entry_dir is given the context does nothing and always returns False.
+    * entry_dir
+        Cache entry directory obtained with get_cache_entry
+    * output_d
+        dict of output_name:output_file or output_directory
+    * source
+        Source file whose checksum is recorded in the manifest
+    * log_fn
+        Log file where to append cache information
+    """
+    def __init__ (self, entry_dir, output_d, source=None, log_fn=None):
+        self.entry_dir = entry_dir
+        self.output_d = output_d
+        self.source = str(source) if source else None
+        self.log_fn = log_fn
+        self.lock_fp = None
+        self.hit = False
+
+    def __enter__ (self):
+        if not self.entry_dir:
+            return False
+        os.makedirs(self.entry_dir, exist_ok=True)
+        self.lock_fp = open(self.entry_dir+".lock", "w")
+        self._log(f"Waiting for lock on cache entry {self.entry_dir}")
+        fcntl.flock(self.lock_fp, fcntl.LOCK_EX)
+
+        if is_cached(self.entry_dir) and all(os.path.exists(os.path.join(self.entry_dir, name)) for name in self.output_d):
+            for name, fn in self.output_d.items():
+                link_type = link_file(os.path.join(self.entry_dir, name), fn)
+                self._log(f"Reused cached {name} ({link_type})")
+            self.hit = True
+        return self.hit
+
+    def __exit__ (self, exc_type, exc_value, traceback):
+        if not self.entry_dir:
+            return False
+        try:
+            if not self.hit and exc_type is None:
+                self._save()
+        finally:
+            fcntl.flock(self.lock_fp, fcntl.LOCK_UN)
+            self.lock_fp.close()
+        return False
+
+    def _save (self):
+        """ Copy outputs to the cache entry and write the manifest last """
+        manifest_fn = os.path.join(self.entry_dir, "manifest.json")
+        for name, fn in self.output_d.items():
+            cache_fn = os.path.join(self.entry_dir, name)
+            if os.path.isdir(cache_fn) and not os.path.islink(cache_fn):
+                shutil.rmtree(cache_fn)
+            elif os.path.lexists(cache_fn):
+                os.remove(cache_fn)
+            if os.path.isdir(fn):
+                shutil.copytree(fn, cache_fn, copy_function=store_file)
+            else:
+                store_file(fn, cache_fn)
+        manifest = {
+            "source": self.source,
+            "source_md5": file_checksum(self.source) if self.source and os.path.isfile(self.source) else None,
+            "files": sorted(self.output_d.keys()),
+            "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+        with open(manifest_fn+".tmp", "w") as fp:
+            json.dump(manifest, fp, indent=2)
+        os.replace(manifest_fn+".tmp", manifest_fn)
+        self._log(f"Saved outputs in cache entry {self.entry_dir}")
+
+    def _log (self, msg):
+        if self.log_fn:
+            with open(str(self.log_fn), "a") as log_fp:
+                log_fp.write(msg+"\n")
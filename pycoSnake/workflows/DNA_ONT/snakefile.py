@@ -2,7 +2,7 @@
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~Imports~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 # Std lib
-from os.path import join
+from os.path import join, dirname, basename
 
 # Third party lib
 import pandas as pd
@@ -10,16 +10,42 @@ from snakemake.logging import logger
 
 # Local imports
 from pycoSnake.common import *
-from snakemake.remote.FTP import RemoteProvider as FTP
-from snakemake.remote.HTTP import RemoteProvider as HTTP
 
 ##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~Getters~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 def get_fastq (wildcards):
-    return sample_df.loc[wildcards.sample, "fastq"]
+    return run_df.loc[(wildcards.sample, wildcards.run), "fastq"]
 def get_fast5 (wildcards):
-    return sample_df.loc[wildcards.sample, "fast5"]
+    return run_df.loc[(wildcards.sample, wildcards.run), "fast5"]
 def get_seqsum (wildcards):
-    return sample_df.loc[wildcards.sample, "seq_summary"]
+    return run_df.loc[(wildcards.sample, wildcards.run), "seq_summary"]
+def get_sample_seqsum (wildcards):
+    return list(run_df.loc[wildcards.sample, "seq_summary"])
+def get_run_list (wildcards):
+    return list(run_df.loc[wildcards.sample].index)
+def get_run_files (pattern):
+    return lambda wildcards: expand(pattern, sample=wildcards.sample, run=get_run_list(wildcards))
+def get_split_dirs (wildcards):
+    return [checkpoints.pbt_alignment_split.get(sample=wildcards.sample, run=run).output.bam_dir for run in get_run_list(wildcards)]
+def get_chunk_tsv (wildcards):
+    tsv_list = []
+    for run, split_dir in zip(get_run_list(wildcards), get_split_dirs(wildcards)):
+        chunk_list = sorted(glob_wildcards(join(split_dir, "{chunk,\\d+}.bam")).chunk, key=int)
+        tsv_list.extend(expand(join("results","methylation","nanopolish_calls",wildcards.sample,run,"{chunk}.tsv.gz"), chunk=chunk_list))
+    return tsv_list
+def get_batch_list (wildcards):
+    batch_dir = checkpoints.fastq_split.get(sample=wildcards.sample, run=wildcards.run).output.batch_dir
+    return sorted(glob_wildcards(join(batch_dir, "{batch,\\d+}.fastq.gz")).batch, key=int)
+def get_batch_files (pattern):
+    return lambda wildcards: expand(pattern, sample=wildcards.sample, run=wildcards.run, batch=get_batch_list(wildcards))
+def get_sub_output (output_d, sub_dir, wildcards):
+    """ Temporary outputs below sub_dir for each value of extra wildcards, eg runs/{sample}/{run}.bam for {sample}.bam """
+    return OrderedDict((k, temp(join(dirname(v), sub_dir, basename(v).replace("{sample}", join("{sample}", wildcards))))) for k, v in output_d.items())
+def get_genome_shards (n_shards):
+    return get_fai_shards(checkpoints.get_genome.get().output.index, n_shards)
+def get_shard_files (pattern, n_shards):
+    return lambda wildcards: expand(pattern, sample=wildcards.sample, shard=range(len(get_genome_shards(n_shards))))
+def get_shard_contigs (n_shards):
+    return lambda wildcards: get_genome_shards(n_shards)[int(wildcards.shard)]
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~Initialise~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 logger.info("Checking configuration file version")
@@ -30,37 +56,95 @@ if not "config_version" in config or config["config_version"]!= config_version:
 logger.debug(config)
 
 logger.info("Loading sample file")
-sample_df=pd.read_csv (config["sample_sheet"], comment="#", skip_blank_lines=True, sep="\t", index_col=0)
+sample_df=pd.read_csv (config["sample_sheet"], comment="#", skip_blank_lines=True, sep="\t", index_col=0, dtype={"run_id":str})
 if not sample_df.index.name=="sample_id" and not all_in(sample_df.columns, ["fastq","fast5","seq_summary"]):
     logger.error ("The provided sample sheet is in the correct format, Please regenerate a template file with `--generate_template sample_sheet -o`")
     sys.exit()
 logger.debug(sample_df)
-sample_list=list(sample_df.index)
+sample_list=list(OrderedDict.fromkeys(sample_df.index))
+
+logger.info("Define sequencing runs")
+# Samples sequenced on several flowcells have one line per run. Runs are processed separately and merged per sample
+if not "run_id" in sample_df.columns:
+    sample_df["run_id"]=(sample_df.groupby(level=0).cumcount()+1).astype(str)
+run_df=sample_df.set_index("run_id", append=True)
+if not run_df.index.is_unique:
+    logger.error ("Run ids have to be unique for each sample in the sample sheet")
+    sys.exit()
+logger.debug(run_df)
 
-logger.info("Define number of chunks")
-try:
-    nchunk=int(config["pbt_alignment_split"]["n_chunks"])
-except:
-    nchunk=4
-chunk_list=list(range(nchunk))
+logger.info("Define methylation calls sorting")
+sort_calls=get_param(config, "nanopolish_concat", "sort", False)
 
 logger.info("Specify way to download reference files")
+# Remote files are downloaded by the wrappers and not at all if they are already in the shared reference cache
+ref_input=OrderedDict()
 ref=config["genome"]
-if ref.startswith("ftp"):
-    ref=FTP().remote(ref)
-elif ref.startswith("http"):
-    ref=HTTP().remote(ref)
-
+ref_cache, cache_hit=get_ref_cache(config, "get_genome", ref)
+ref_url=ref if is_remote(ref) and not cache_hit else ""
+if cache_hit:
+    logger.info(f"Using cached get_genome outputs from {ref_cache}")
+elif not ref_url:
+    ref_input["ref"]=ref
+
+gff3_input=OrderedDict()
 gff3=config["annotation"]
-if gff3.startswith("ftp"):
-    gff3=FTP().remote(gff3)
-elif gff3.startswith("http"):
-    gff3=HTTP().remote(gff3)
+gff3_cache, cache_hit=get_ref_cache(config, "get_annotation", gff3)
+gff3_url=gff3 if is_remote(gff3) and not cache_hit else ""
+if cache_hit:
+    logger.info(f"Using cached get_annotation outputs from {gff3_cache}")
+elif not gff3_url:
+    gff3_input["gff3"]=gff3
+
+logger.info("Define annotation outputs")
+annotation_output=OrderedDict()
+annotation_output["gff3"]=join("results","input","annotation","annotation.gff3")
+annotation_output["gtf"]=join("results","input","annotation","annotation.gtf")
+if get_param(config, "get_annotation", "index", False):
+    annotation_output["index_dir"]=directory(join("results","input","annotation","annotation_index"))
+
+logger.info("Define alignment outputs")
+# In fused mode minimap2_align also writes the filtered alignments and pbt_alignment_filter is not used
+fused_filter=get_param(config, "minimap2_align", "fused_filter", False)
+filtered_output=OrderedDict()
+filtered_output["bam"]=join("results","main","filtered_alignments","{sample}.bam")
+filtered_output["bam_index"]=join("results","main","filtered_alignments","{sample}.bam.bai")
+minimap2_output=OrderedDict()
+minimap2_output["bam"]=join("results","main","minimap2_alignments","{sample}.bam")
+minimap2_output["bam_index"]=join("results","main","minimap2_alignments","{sample}.bam.bai")
+if fused_filter:
+    minimap2_output["filtered_bam"]=filtered_output["bam"]
+    minimap2_output["filtered_bam_index"]=filtered_output["bam_index"]
+ngmlr_output=OrderedDict()
+ngmlr_output["bam"]=join("results","SV","ngmlr_alignments","{sample}.bam")
+ngmlr_output["bam_index"]=join("results","SV","ngmlr_alignments","{sample}.bam.bai")
+
+logger.info("Define per run and per batch alignment outputs")
+# If batch_size is set, the filtered reads of each run are split in batches aligned as separate jobs and merged
+batch_size=get_param(config, "fastq_split", "batch_size", 0)
+batch_dir=join("results","input","fastq_batches","{sample}","{run}")
+minimap2_run_output=get_sub_output(minimap2_output, "runs", "{run}")
+minimap2_batch_output=get_sub_output(minimap2_output, "batches", join("{run}","{batch}"))
+ngmlr_run_output=get_sub_output(ngmlr_output, "runs", "{run}")
+ngmlr_batch_output=get_sub_output(ngmlr_output, "batches", join("{run}","{batch}"))
+
+logger.info("Define intermediate files compression")
+# Intermediate files can be compressed with fast multi-threaded BGZF to save I/O bandwidth
+intermediate_compression=config.get("intermediate_compression", False)
+compression_level=1 if intermediate_compression else None
+
+logger.info("Define read filtering mode")
+# In streaming mode reads are filtered by minimap2_align while they are aligned and pbt_fastq_filter is not used
+filtered_fastq=join("results","input","merged_fastq","{sample}","{run}.fastq.gz" if intermediate_compression else "{run}.fastq")
+stream_filter=get_param(config, "pbt_fastq_filter", "stream", False)
+if stream_filter and batch_size:
+    logger.warning("Streaming read filtering is not compatible with batch alignment and was disabled")
+    stream_filter=False
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~Define all output depending on config file~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 logger.info("Define conditional target files")
 target_files=[]
-target_files.extend(expand(join("results","main","filtered_alignments","{sample}.bam"), sample=sample_list))
+target_files.extend(expand(filtered_output["bam"], sample=sample_list))
 
 if config["dna_methylation_call"] is True:
     logger.info("\tInclude rules for 'dna_methylation_call' module")
@@ -92,42 +176,58 @@ for fn in target_files:
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~RULES~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
+wildcard_constraints:
+    sample="[^/]+",
+    run="[^/]+"
+
 rule all:
     input: target_files
 
 rule_name="get_genome"
-rule get_genome:
-    input: ref=ref
+checkpoint get_genome:
+    input: **ref_input
     output:
         ref=join("results","input","genome","genome.fa"),
-        index=join("results","input","genome","genome.fa.fai")
+        index=join("results","input","genome","genome.fa.fai"),
+        dropped=join("results","input","genome","dropped_contigs.tsv")
     log: join("logs",rule_name,"out.log")
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=ref_cache,
+        url=ref_url,
+        include=get_param(config, rule_name, "include", ""),
+        exclude=get_param(config, rule_name, "exclude", ""),
+        min_length=get_param(config, rule_name, "min_length", 0),
+        primary_only=get_param(config, rule_name, "primary_only", False)
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "get_genome"
 
 rule_name="get_annotation"
 rule get_annotation:
-    input: gff3=gff3
-    output:
-        gff3=join("results","input","annotation","annotation.gff3"),
-        gtf=join("results","input","annotation","annotation.gtf")
+    input: **gff3_input
+    output: **annotation_output
     log: join("logs", rule_name, "out.log")
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=gff3_cache,
+        url=gff3_url
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "get_annotation"
 
-rule_name="pbt_fastq_filter"
-rule pbt_fastq_filter:
-    input: fastq=get_fastq
-    output: fastq=join("results","input","merged_fastq","{sample}.fastq")
-    log: join("logs",rule_name,"{sample}.log")
-    threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
-    resources: mem_mb=get_mem(config, rule_name)
-    wrapper: "pbt_fastq_filter"
+if not stream_filter:
+    rule_name="pbt_fastq_filter"
+    rule pbt_fastq_filter:
+        input: fastq=get_fastq
+        output: fastq=filtered_fastq
+        log: join("logs",rule_name,"{sample}","{run}.log")
+        threads: get_threads(config, rule_name)
+        params:
+            opt=get_opt(config, rule_name),
+            compression_level=compression_level
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "pbt_fastq_filter"
 
 rule_name="minimap2_index"
 rule minimap2_index:
@@ -135,80 +235,164 @@ rule minimap2_index:
     output: index=join("results","main","minimap2_index","ref.mmi")
     log: join("logs",rule_name,"ref.log")
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=config.get("reference_cache", "")
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "minimap2_index"
 
 rule_name="minimap2_align"
-rule minimap2_align:
-    input:
-        index=rules.minimap2_index.output.index,
-        fastq=rules.pbt_fastq_filter.output.fastq
-    output:
-        bam=join("results","main","minimap2_alignments","{sample}.bam"),
-        bam_index=join("results","main","minimap2_alignments","{sample}.bam.bai")
+minimap2_params=OrderedDict()
+minimap2_params["opt"]=get_opt(config, rule_name)
+minimap2_params["min_mapq"]=get_param(config, rule_name, "min_mapq", 0)
+minimap2_params["min_align_len"]=get_param(config, rule_name, "min_align_len", 0)
+minimap2_params["min_identity"]=get_param(config, rule_name, "min_identity", 0)
+minimap2_params["skip_unmapped"]=get_param(config, rule_name, "skip_unmapped", True)
+minimap2_params["skip_secondary"]=get_param(config, rule_name, "skip_secondary", True)
+minimap2_params["skip_supplementary"]=get_param(config, rule_name, "skip_supplementary", True)
+if batch_size:
+    rule_name="fastq_split"
+    checkpoint fastq_split:
+        input: fastq=filtered_fastq
+        output: batch_dir=temp(directory(batch_dir))
+        log: join("logs",rule_name,"{sample}","{run}.log")
+        threads: get_threads(config, rule_name)
+        params:
+            opt=get_opt(config, rule_name),
+            batch_size=batch_size
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "fastq_split"
+
+    # Batches share the alignment options of minimap2_align and default to its resources
+    rule_name="minimap2_batch_align"
+    rule minimap2_batch_align:
+        input:
+            index=rules.minimap2_index.output.index,
+            fastq=join(batch_dir,"{batch}.fastq.gz")
+        output: **minimap2_batch_output
+        wildcard_constraints: batch="\\d+"
+        log: join("logs",rule_name,"{sample}","{run}","{batch}.log")
+        threads: get_threads(config, rule_name, get_threads(config, "minimap2_align"))
+        params: **minimap2_params
+        resources: mem_mb=get_mem(config, rule_name, get_mem(config, "minimap2_align"))
+        wrapper: "minimap2_align"
+
+    rule_name="minimap2_batch_merge"
+    rule minimap2_batch_merge:
+        input:
+            batch_dir=batch_dir,
+            **{k:get_batch_files(v) for k, v in minimap2_batch_output.items()}
+        output: **minimap2_run_output
+        log: join("logs",rule_name,"{sample}","{run}.log")
+        threads: get_threads(config, rule_name)
+        params: opt=get_opt(config, rule_name)
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "samtools_merge"
+
+elif stream_filter:
+    rule_name="minimap2_align"
+    rule minimap2_align:
+        input:
+            index=rules.minimap2_index.output.index,
+            fastq=get_fastq
+        output: fastq=filtered_fastq, **minimap2_run_output
+        log: join("logs",rule_name,"{sample}","{run}.log")
+        threads: get_threads(config, rule_name)
+        params: fastq_filter_opt=get_opt(config, "pbt_fastq_filter"), compression_level=compression_level, **minimap2_params
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "minimap2_align"
+
+else:
+    rule_name="minimap2_align"
+    rule minimap2_align:
+        input:
+            index=rules.minimap2_index.output.index,
+            fastq=filtered_fastq
+        output: **minimap2_run_output
+        log: join("logs",rule_name,"{sample}","{run}.log")
+        threads: get_threads(config, rule_name)
+        params: **minimap2_params
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "minimap2_align"
+
+rule_name="minimap2_merge"
+rule minimap2_merge:
+    input: **{k:get_run_files(v) for k, v in minimap2_run_output.items()}
+    output: **minimap2_output
     log: join("logs",rule_name,"{sample}.log")
     threads: get_threads(config, rule_name)
     params: opt=get_opt(config, rule_name)
     resources: mem_mb=get_mem(config, rule_name)
-    wrapper: "minimap2_align"
-
-rule_name="pbt_alignment_filter"
-rule pbt_alignment_filter:
-    input: bam=rules.minimap2_align.output.bam
-    output:
-        bam=join("results","main","filtered_alignments","{sample}.bam"),
-        bam_index=join("results","main","filtered_alignments","{sample}.bam.bai")
-    log: join("logs",rule_name,"{sample}.log")
-    threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
-    resources: mem_mb=get_mem(config, rule_name)
-    wrapper: "pbt_alignment_filter"
+    wrapper: "samtools_merge"
+
+if not fused_filter:
+    rule_name="pbt_alignment_filter"
+    rule pbt_alignment_filter:
+        input: bam=minimap2_output["bam"]
+        output: **filtered_output
+        log: join("logs",rule_name,"{sample}.log")
+        threads: get_threads(config, rule_name)
+        params: opt=get_opt(config, rule_name)
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "pbt_alignment_filter"
 
 rule_name="nanopolish_index"
 rule nanopolish_index:
     input:
-        fastq=rules.pbt_fastq_filter.output.fastq,
+        fastq=filtered_fastq,
         fast5=get_fast5,
         seqsum=get_seqsum
-    output: index=join("results","input","merged_fastq","{sample}.fastq.index")
-    log: join("logs",rule_name,"{sample}.log")
+    output: index=filtered_fastq+".index"
+    log: join("logs",rule_name,"{sample}","{run}.log")
     threads: get_threads(config, rule_name)
     params: opt=get_opt(config, rule_name),
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "nanopolish_index"
 
 rule_name="pbt_alignment_split"
-rule pbt_alignment_split:
-    input: bam=rules.minimap2_align.output.bam
-    output:
-        bam=temp(expand(join("results","methylation","split_alignments","{{sample}}","{chunk}.bam"), chunk=chunk_list)),
-        bam_index=temp(expand(join("results","methylation","split_alignments","{{sample}}","{chunk}.bam.bai"), chunk=chunk_list))
-    log: join("logs",rule_name,"{sample}.log")
+checkpoint pbt_alignment_split:
+    input:
+        bam=minimap2_run_output["bam"],
+        bam_index=minimap2_run_output["bam_index"]
+    output: bam_dir=temp(directory(join("results","methylation","split_alignments","{sample}","{run}")))
+    log: join("logs",rule_name,"{sample}","{run}.log")
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name),
+    params:
+        opt=get_opt(config, rule_name),
+        split_mode=get_param(config, rule_name, "split_mode", "reads"),
+        n_chunks=get_param(config, rule_name, "n_chunks", 4),
+        chunk_size=get_param(config, rule_name, "chunk_size", 0),
+        max_chunks=get_param(config, rule_name, "max_chunks", 0)
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "pbt_alignment_split"
 
 rule_name="nanopolish_call_methylation"
 rule nanopolish_call_methylation:
     input:
-        fastq=rules.pbt_fastq_filter.output.fastq,
+        fastq=filtered_fastq,
         fastq_index=rules.nanopolish_index.output.index,
-        bam=join("results","methylation","split_alignments","{sample}","{chunk}.bam"),
-        bam_index=join("results","methylation","split_alignments","{sample}","{chunk}.bam.bai"),
+        bam=join("results","methylation","split_alignments","{sample}","{run}","{chunk}.bam"),
+        bam_index=join("results","methylation","split_alignments","{sample}","{run}","{chunk}.bam.bai"),
         ref=rules.get_genome.output.ref
-    output: tsv=temp(join("results","methylation","nanopolish_calls","{sample}","{chunk}.tsv"))
-    log: join("logs",rule_name,"{sample}","{chunk}.log")
+    output: tsv=temp(join("results","methylation","nanopolish_calls","{sample}","{run}","{chunk,\\d+}.tsv.gz"))
+    log: join("logs",rule_name,"{sample}","{run}","{chunk}.log")
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name),
+    params:
+        opt=get_opt(config, rule_name),
+        sort=sort_calls,
+        compression_level=compression_level
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "nanopolish_call_methylation"
 
 rule_name="nanopolish_concat"
+nanopolish_concat_output={"tsv":protected(join("results","methylation","nanopolish_calls","{sample}.tsv.gz"))}
+if sort_calls:
+    nanopolish_concat_output["tsv_index"]=protected(join("results","methylation","nanopolish_calls","{sample}.tsv.gz.tbi"))
 rule nanopolish_concat:
-    input: tsv_list=expand(join("results","methylation","nanopolish_calls","{{sample}}","{chunk}.tsv"), chunk=chunk_list)
-    output: tsv=protected(join("results","methylation","nanopolish_calls","{sample}.tsv.gz"))
+    input:
+        tsv_list=get_chunk_tsv,
+        bam_dir=get_split_dirs
+    output: **nanopolish_concat_output
     log: join("logs",rule_name,"{sample}.log")
     threads: get_threads(config, rule_name)
     params: opt=get_opt(config, rule_name),
@@ -229,24 +413,61 @@ rule pycometh_cgi_finder:
     wrapper: "pycometh_cgi_finder"
 
 rule_name="pycometh_cpg_aggregate"
-rule pycometh_cpg_aggregate:
-    input:
-        tsv= rules.nanopolish_concat.output.tsv,
-        ref=rules.get_genome.output.ref
-    output:
-        tsv=join("results","methylation","pycometh_cpg_aggregate","{sample}.tsv.gz"),
-        bed=join("results","methylation","pycometh_cpg_aggregate","{sample}.bed"),
-        bed_index=join("results","methylation","pycometh_cpg_aggregate","{sample}.bed.idx")
-    log: join("logs",rule_name,"{sample}.log")
-    threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name),
-    resources: mem_mb=get_mem(config, rule_name)
-    wrapper: "pycometh_cpg_aggregate"
+cpg_aggregate_shards=get_param(config, rule_name, "n_shards", 1)
+if cpg_aggregate_shards > 1:
+    # Shards share the aggregation options of pycometh_cpg_aggregate but have their own resources
+    rule_name="pycometh_cpg_aggregate_shard"
+    rule pycometh_cpg_aggregate_shard:
+        input:
+            tsv=rules.nanopolish_concat.output.tsv,
+            ref=rules.get_genome.output.ref
+        output:
+            tsv=temp(join("results","methylation","pycometh_cpg_aggregate","shards","{sample}","{shard,\\d+}.tsv.gz")),
+            bed=temp(join("results","methylation","pycometh_cpg_aggregate","shards","{sample}","{shard,\\d+}.bed"))
+        log: join("logs",rule_name,"{sample}","{shard}.log")
+        threads: get_threads(config, rule_name)
+        params:
+            opt=get_opt(config, "pycometh_cpg_aggregate"),
+            sample_id=lambda wildcards: wildcards.sample,
+            contigs=get_shard_contigs(cpg_aggregate_shards)
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "pycometh_cpg_aggregate"
+
+    rule_name="pycometh_cpg_aggregate_gather"
+    rule pycometh_cpg_aggregate_gather:
+        input:
+            tsv=get_shard_files(join("results","methylation","pycometh_cpg_aggregate","shards","{sample}","{shard}.tsv.gz"), cpg_aggregate_shards),
+            bed=get_shard_files(join("results","methylation","pycometh_cpg_aggregate","shards","{sample}","{shard}.bed"), cpg_aggregate_shards)
+        output:
+            tsv=join("results","methylation","pycometh_cpg_aggregate","{sample}.tsv.gz"),
+            bed=join("results","methylation","pycometh_cpg_aggregate","{sample}.bed"),
+            bed_index=join("results","methylation","pycometh_cpg_aggregate","{sample}.bed.idx")
+        log: join("logs",rule_name,"{sample}.log")
+        threads: get_threads(config, rule_name)
+        params: opt=get_opt(config, rule_name),
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "shard_gather"
+
+else:
+    rule_name="pycometh_cpg_aggregate"
+    rule pycometh_cpg_aggregate:
+        input:
+            tsv= rules.nanopolish_concat.output.tsv,
+            ref=rules.get_genome.output.ref
+        output:
+            tsv=join("results","methylation","pycometh_cpg_aggregate","{sample}.tsv.gz"),
+            bed=join("results","methylation","pycometh_cpg_aggregate","{sample}.bed"),
+            bed_index=join("results","methylation","pycometh_cpg_aggregate","{sample}.bed.idx")
+        log: join("logs",rule_name,"{sample}.log")
+        threads: get_threads(config, rule_name)
+        params: opt=get_opt(config, rule_name),
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "pycometh_cpg_aggregate"
 
 rule_name="pycometh_interval_aggregate"
 rule pycometh_interval_aggregate:
     input:
-        tsv=rules.pycometh_cpg_aggregate.output.tsv,
+        tsv=join("results","methylation","pycometh_cpg_aggregate","{sample}.tsv.gz"),
         ref=rules.get_genome.output.ref,
         annot=rules.pycometh_cgi_finder.output.bed
     output:
@@ -287,21 +508,59 @@ rule pycometh_comp_report:
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "pycometh_comp_report"
 
-rule_name="ngmlr"
-rule ngmlr:
-    input:
-        ref=rules.get_genome.output.ref,
-        fastq=rules.pbt_fastq_filter.output.fastq
-    output: bam=join("results","SV","ngmlr_alignments","{sample}.bam")
+if batch_size:
+    # Batches share the alignment options of ngmlr and default to its resources
+    rule_name="ngmlr_batch_align"
+    rule ngmlr_batch_align:
+        input:
+            ref=rules.get_genome.output.ref,
+            fastq=join(batch_dir,"{batch}.fastq.gz")
+        output: **ngmlr_batch_output
+        wildcard_constraints: batch="\\d+"
+        log: join("logs",rule_name,"{sample}","{run}","{batch}.log")
+        threads: get_threads(config, rule_name, get_threads(config, "ngmlr"))
+        params: opt=get_opt(config, "ngmlr")
+        resources: mem_mb=get_mem(config, rule_name, get_mem(config, "ngmlr"))
+        wrapper: "ngmlr"
+
+    rule_name="ngmlr_batch_merge"
+    rule ngmlr_batch_merge:
+        input:
+            batch_dir=batch_dir,
+            **{k:get_batch_files(v) for k, v in ngmlr_batch_output.items()}
+        output: **ngmlr_run_output
+        log: join("logs",rule_name,"{sample}","{run}.log")
+        threads: get_threads(config, rule_name)
+        params: opt=get_opt(config, rule_name)
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "samtools_merge"
+
+else:
+    rule_name="ngmlr"
+    rule ngmlr:
+        input:
+            ref=rules.get_genome.output.ref,
+            fastq=filtered_fastq
+        output: **ngmlr_run_output
+        log: join("logs",rule_name,"{sample}","{run}.log")
+        threads: get_threads(config, rule_name)
+        params: opt=get_opt(config, rule_name)
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "ngmlr"
+
+rule_name="ngmlr_merge"
+rule ngmlr_merge:
+    input: **{k:get_run_files(v) for k, v in ngmlr_run_output.items()}
+    output: **ngmlr_output
     log: join("logs",rule_name,"{sample}.log")
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name),
+    params: opt=get_opt(config, rule_name)
     resources: mem_mb=get_mem(config, rule_name)
-    wrapper: "ngmlr"
+    wrapper: "samtools_merge"
 
 rule_name="sniffles"
 rule sniffles:
-    input: bam=rules.ngmlr.output.bam
+    input: bam=ngmlr_output["bam"]
     output: vcf=join("results","SV","sniffles","{sample}_raw.vcf")
     log: join("logs",rule_name,"{sample}.log")
     threads: get_threads(config, rule_name)
@@ -332,7 +591,7 @@ rule survivor_merge:
 rule_name="sniffles_all"
 rule sniffles_all:
     input:
-        bam=rules.ngmlr.output.bam,
+        bam=ngmlr_output["bam"],
         vcf=rules.survivor_merge.output.vcf
     output: vcf=join("results","SV","sniffles_all","{sample}_raw.vcf")
     log: join("logs",rule_name,"{sample}.log")
@@ -354,8 +613,8 @@ rule survivor_merge_all:
 rule_name="pycoqc"
 rule pycoqc:
     input:
-        seqsum=get_seqsum,
-        bam=rules.minimap2_align.output.bam
+        seqsum=get_sample_seqsum,
+        bam=minimap2_output["bam"]
     output:
         html=join("results","QC","pycoqc","{sample}_pycoqc.html"),
         json=join("results","QC","pycoqc","{sample}_pycoqc.json")
@@ -367,7 +626,7 @@ rule pycoqc:
 
 rule_name="samtools_qc"
 rule samtools_qc:
-    input: bam=rules.minimap2_align.output.bam
+    input: bam=minimap2_output["bam"]
     output:
         stats=join("results","QC","samtools_qc","{sample}_samtools_stats.txt"),
         flagstat=join("results","QC","samtools_qc","{sample}_samtools_flagstat.txt"),
@@ -379,19 +638,48 @@ rule samtools_qc:
     wrapper: "samtools_qc"
 
 rule_name="bedtools_genomecov"
-rule bedtools_genomecov:
-    input: bam=rules.pbt_alignment_filter.output.bam
-    output: bedgraph=join("results","coverage","bedgraph","{sample}.bedgraph")
-    log: join("logs",rule_name,"{sample}.log")
-    threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
-    resources: mem_mb=get_mem(config, rule_name)
-    wrapper: "bedtools_genomecov"
+genomecov_shards=get_param(config, rule_name, "n_shards", 1)
+if genomecov_shards > 1:
+    rule_name="bedtools_genomecov_shard"
+    rule bedtools_genomecov_shard:
+        input:
+            bam=filtered_output["bam"],
+            bam_index=filtered_output["bam_index"]
+        output: bedgraph=temp(join("results","coverage","bedgraph","shards","{sample}","{shard,\\d+}.bedgraph"))
+        log: join("logs",rule_name,"{sample}","{shard}.log")
+        threads: get_threads(config, rule_name)
+        params:
+            opt=get_opt(config, "bedtools_genomecov"),
+            sample_id=lambda wildcards: wildcards.sample,
+            contigs=get_shard_contigs(genomecov_shards)
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "bedtools_genomecov"
+
+    rule_name="bedtools_genomecov_gather"
+    rule bedtools_genomecov_gather:
+        input: bedgraph=get_shard_files(join("results","coverage","bedgraph","shards","{sample}","{shard}.bedgraph"), genomecov_shards)
+        output: bedgraph=join("results","coverage","bedgraph","{sample}.bedgraph")
+        log: join("logs",rule_name,"{sample}.log")
+        threads: get_threads(config, rule_name)
+        params: opt=get_opt(config, rule_name),
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "shard_gather"
+
+else:
+    rule_name="bedtools_genomecov"
+    rule bedtools_genomecov:
+        input: bam=filtered_output["bam"]
+        output: bedgraph=join("results","coverage","bedgraph","{sample}.bedgraph")
+        log: join("logs",rule_name,"{sample}.log")
+        threads: get_threads(config, rule_name)
+        params: opt=get_opt(config, rule_name)
+        resources: mem_mb=get_mem(config, rule_name)
+        wrapper: "bedtools_genomecov"
 
 rule_name="igvtools_count"
 rule igvtools_count:
     input:
-        bam=rules.pbt_alignment_filter.output.bam,
+        bam=filtered_output["bam"],
         ref=rules.get_genome.output.ref
     output: tdf=join("results","coverage","igv_tdf","{sample}.tdf")
     log: join("logs",rule_name,"{sample}.log")
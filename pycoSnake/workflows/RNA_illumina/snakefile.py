@@ -9,10 +9,6 @@ import pandas as pd
 
 # Local imports
 from pycoSnake.common import *
-from snakemake.remote.FTP import RemoteProvider as FTPRemoteProvider
-from snakemake.remote.HTTP import RemoteProvider as HTTPRemoteProvider
-FTP = FTPRemoteProvider()
-HTTP = HTTPRemoteProvider()
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~check config file version~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 # Minimum snakemake version
@@ -34,33 +30,43 @@ def get_fastq2 (wildcards):
 input_d=defaultdict(OrderedDict)
 output_d=defaultdict(OrderedDict)
 log_d=OrderedDict()
+ref_cache_d=OrderedDict()
+url_d=defaultdict(str)
 
+# Remote files are downloaded by the wrappers and not at all if they are already in the shared reference cache
 rule_name="get_genome"
 ref = config["genome"]
-if ref.startswith("ftp"): input_d[rule_name]["ref"]=FTP.remote(ref)
-elif ref.startswith("http"): input_d[rule_name]["ref"]=HTTP.remote(ref)
+ref_cache_d[rule_name], cache_hit = get_ref_cache(config, rule_name, ref)
+if cache_hit: logger.info(f"Using cached {rule_name} outputs from {ref_cache_d[rule_name]}")
+elif is_remote(ref): url_d[rule_name]=ref
 else: input_d[rule_name]["ref"]=ref
 output_d[rule_name]["ref"]=join("results","input","genome","genome.fa")
 output_d[rule_name]["index"]=join("results","input","genome","genome.fa.fai")
+output_d[rule_name]["dropped"]=join("results","input","genome","dropped_contigs.tsv")
 log_d[rule_name]=join("logs",rule_name,"get_genome.log")
 
 rule_name="get_transcriptome"
 ref = config["transcriptome"]
-if ref.startswith("ftp"): input_d[rule_name]["ref"]=FTP.remote(ref)
-elif ref.startswith("http"): input_d[rule_name]["ref"]=HTTP.remote(ref)
+ref_cache_d[rule_name], cache_hit = get_ref_cache(config, rule_name, ref)
+if cache_hit: logger.info(f"Using cached {rule_name} outputs from {ref_cache_d[rule_name]}")
+elif is_remote(ref): url_d[rule_name]=ref
 else: input_d[rule_name]["ref"]=ref
 output_d[rule_name]["ref"]=join("results","input","transcriptome","transcriptome.fa")
 output_d[rule_name]["tsv"]=join("results","input","transcriptome","transcriptome.tsv")
 output_d[rule_name]["index"]=join("results","input","transcriptome","transcriptome.fa.fai")
+output_d[rule_name]["dropped"]=join("results","input","transcriptome","dropped_transcripts.tsv")
 log_d[rule_name]=join("logs",rule_name,"get_transcriptome.log")
 
 rule_name="get_annotation"
 gff3 = config["annotation"]
-if gff3.startswith("ftp"): input_d[rule_name]["gff3"]=FTP.remote(gff3)
-elif gff3.startswith("http"): input_d[rule_name]["gff3"]=HTTP.remote(gff3)
+ref_cache_d[rule_name], cache_hit = get_ref_cache(config, rule_name, gff3)
+if cache_hit: logger.info(f"Using cached {rule_name} outputs from {ref_cache_d[rule_name]}")
+elif is_remote(gff3): url_d[rule_name]=gff3
 else: input_d[rule_name]["gff3"]=gff3
 output_d[rule_name]["gff3"]=join("results","input","annotation","annotation.gff3")
 output_d[rule_name]["gtf"]=join("results","input","annotation","annotation.gtf")
+if get_param(config, rule_name, "index", False):
+    output_d[rule_name]["index_dir"]=directory(join("results","input","annotation","annotation_index"))
 log_d[rule_name]=join("logs",rule_name,"get_annotation.log")
 
 rule_name="fastp"
@@ -97,9 +103,12 @@ log_d[rule_name]=join("logs",rule_name,"{sample}.log")
 
 rule_name="star_count_merge"
 input_d[rule_name]["counts"]=expand(join("results","counts","star","{sample}_counts.tsv"),sample=sample_list)
-output_d[rule_name]["unstranded_counts"]=join("results","counts","star_merged","unstranded_counts.tsv")
-output_d[rule_name]["positive_counts"]=join("results","counts","star_merged","positive_counts.tsv")
-output_d[rule_name]["negative_counts"]=join("results","counts","star_merged","negative_counts.tsv")
+matrix_ext=get_param(config, rule_name, "format", "tsv")
+output_d[rule_name]["unstranded_counts"]=join("results","counts","star_merged",f"unstranded_counts.{matrix_ext}")
+output_d[rule_name]["positive_counts"]=join("results","counts","star_merged",f"positive_counts.{matrix_ext}")
+output_d[rule_name]["negative_counts"]=join("results","counts","star_merged",f"negative_counts.{matrix_ext}")
+if get_param(config, rule_name, "store", False):
+    output_d[rule_name]["store"]=join("results","counts","star_merged","counts.h5")
 log_d[rule_name]=join("logs",rule_name,"star_count_merge.log")
 
 rule_name="cufflinks"
@@ -113,8 +122,9 @@ log_d[rule_name]=join("logs",rule_name,"{sample}.log")
 rule_name="cufflinks_fpkm_merge"
 input_d[rule_name]["fpkm_genes"]=expand(join("results","counts","cufflinks","{sample}_genes_fpkm.tsv"), sample=sample_list)
 input_d[rule_name]["fpkm_isoforms"]=expand(join("results","counts","cufflinks","{sample}_isoforms_fpkm.tsv"), sample=sample_list)
-output_d[rule_name]["fpkm_genes"]=join("results","counts","cufflinks_merged","fpkm_genes.tsv")
-output_d[rule_name]["fpkm_isoforms"]=join("results","counts","cufflinks_merged","fpkm_isoforms.tsv")
+matrix_ext=get_param(config, rule_name, "format", "tsv")
+output_d[rule_name]["fpkm_genes"]=join("results","counts","cufflinks_merged",f"fpkm_genes.{matrix_ext}")
+output_d[rule_name]["fpkm_isoforms"]=join("results","counts","cufflinks_merged",f"fpkm_isoforms.{matrix_ext}")
 log_d[rule_name]=join("logs",rule_name,"cufflinks_fpkm_merge.log")
 
 rule_name="subread_featurecounts"
@@ -125,8 +135,9 @@ log_d[rule_name]=join("logs",rule_name,"{sample}.log")
 
 rule_name="subread_featurecounts_merge"
 input_d[rule_name]["counts"]=expand(join("results","counts","featurecounts","{sample}_counts.tsv"), sample=sample_list)
-output_d[rule_name]["counts"]=join("results","counts","featurecounts_merged","counts.tsv")
-output_d[rule_name]["tpm"]=join("results","counts","featurecounts_merged","tpm.tsv")
+matrix_ext=get_param(config, rule_name, "format", "tsv")
+output_d[rule_name]["counts"]=join("results","counts","featurecounts_merged",f"counts.{matrix_ext}")
+output_d[rule_name]["tpm"]=join("results","counts","featurecounts_merged",f"tpm.{matrix_ext}")
 log_d[rule_name]=join("logs",rule_name,"subread_featurecounts_merge.log")
 
 rule_name="samtools_qc"
@@ -162,8 +173,9 @@ log_d[rule_name]=join("logs",rule_name,"{sample}.log")
 
 rule_name="salmon_count_merge"
 input_d[rule_name]["counts"]=expand(join("results","counts","salmon_quant","{sample}_counts.tsv"), sample=sample_list)
-output_d[rule_name]["counts"]=join("results","counts","salmon_count_merge","counts.tsv")
-output_d[rule_name]["tpm"]=join("results","counts","salmon_count_merge","tpm.tsv")
+matrix_ext=get_param(config, rule_name, "format", "tsv")
+output_d[rule_name]["counts"]=join("results","counts","salmon_count_merge",f"counts.{matrix_ext}")
+output_d[rule_name]["tpm"]=join("results","counts","salmon_count_merge",f"tpm.{matrix_ext}")
 log_d[rule_name]=join("logs",rule_name,"salmon_count_merge.log")
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~Define all output depending on config file~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
@@ -212,7 +224,14 @@ rule get_genome:
     output: **output_d[rule_name]
     log: log_d[rule_name]
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=ref_cache_d[rule_name],
+        url=url_d[rule_name],
+        include=get_param(config, rule_name, "include", ""),
+        exclude=get_param(config, rule_name, "exclude", ""),
+        min_length=get_param(config, rule_name, "min_length", 0),
+        primary_only=get_param(config, rule_name, "primary_only", False)
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "get_genome"
 
@@ -222,7 +241,14 @@ rule get_transcriptome:
     output: **output_d[rule_name]
     log: log_d[rule_name]
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=ref_cache_d[rule_name],
+        url=url_d[rule_name],
+        include=get_param(config, rule_name, "include", ""),
+        exclude=get_param(config, rule_name, "exclude", ""),
+        min_length=get_param(config, rule_name, "min_length", 0),
+        primary_only=get_param(config, rule_name, "primary_only", False)
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "get_transcriptome"
 
@@ -232,7 +258,10 @@ rule get_annotation:
     output: **output_d[rule_name]
     log: log_d[rule_name]
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=ref_cache_d[rule_name],
+        url=url_d[rule_name]
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "get_annotation"
 
@@ -252,7 +281,9 @@ rule star_index:
     output: **output_d[rule_name]
     log: log_d[rule_name]
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=config.get("reference_cache", "")
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "star_index"
 
@@ -282,7 +313,10 @@ rule star_count_merge:
     output: **output_d[rule_name]
     log: log_d[rule_name]
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=join("results","counts","merge_cache",rule_name) if get_param(config, rule_name, "incremental", False) else None,
+        compact=get_param(config, rule_name, "compact", False)
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "star_count_merge"
 
@@ -302,7 +336,10 @@ rule cufflinks_fpkm_merge:
     output: **output_d[rule_name]
     log: log_d[rule_name]
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=join("results","counts","merge_cache",rule_name) if get_param(config, rule_name, "incremental", False) else None,
+        compact=get_param(config, rule_name, "compact", False)
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "cufflinks_fpkm_merge"
 
@@ -322,7 +359,10 @@ rule subread_featurecounts_merge:
     output: **output_d[rule_name]
     log: log_d[rule_name]
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=join("results","counts","merge_cache",rule_name) if get_param(config, rule_name, "incremental", False) else None,
+        compact=get_param(config, rule_name, "compact", False)
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "subread_featurecounts_merge"
 
@@ -362,7 +402,9 @@ rule salmon_index:
     output: **output_d[rule_name]
     log: log_d[rule_name]
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=config.get("reference_cache", "")
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "salmon_index"
 
@@ -382,6 +424,9 @@ rule salmon_count_merge:
     output: **output_d[rule_name]
     log: log_d[rule_name]
     threads: get_threads(config, rule_name)
-    params: opt=get_opt(config, rule_name)
+    params:
+        opt=get_opt(config, rule_name),
+        cache_dir=join("results","counts","merge_cache",rule_name) if get_param(config, rule_name, "incremental", False) else None,
+        compact=get_param(config, rule_name, "compact", False)
     resources: mem_mb=get_mem(config, rule_name)
     wrapper: "salmon_count_merge"
@@ -6,10 +6,11 @@ bam_ont_input = join(config["data_dir"], "ont_DNA", "reads.bam")
 bam_illumina_input = join(config["data_dir"], "illumina_RNA", "reads_1.bam")
 bg_ont_output = "ont_reads.bedgraph"
 bg_illumina_output = "illumina_reads.bedgraph"
+bg_ont_shard_output = "ont_reads_shard.bedgraph"
 
 # Rules
 rule all:
-    input: [bg_ont_output, bg_illumina_output]
+    input: [bg_ont_output, bg_illumina_output, bg_ont_shard_output]
 
 rule genomecov_ont:
     input: bam=bam_ont_input
@@ -24,3 +25,10 @@ rule genomecov_illumina:
     log: "genomecov_illumina.log"
     params: opt="", sample_id="illumina"
     wrapper: "bedtools_genomecov"
+
+rule genomecov_ont_shard:
+    input: bam=bam_ont_input
+    output: bedgraph="ont_reads_shard.bedgraph"
+    log: "genomecov_ont_shard.log"
+    params: opt="-bga", sample_id="ont", contigs=["I", "II"]
+    wrapper: "bedtools_genomecov"
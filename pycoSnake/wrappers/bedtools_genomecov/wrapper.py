@@ -1,9 +1,10 @@
 # Imports
 from snakemake.shell import shell
+import os
 
 # Wrapper info
 wrapper_name = "bedtools_genomecov"
-wrapper_version = "0.0.2"
+wrapper_version = "0.0.3"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
@@ -12,6 +13,7 @@ shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {lic
 opt = snakemake.params.get("opt", "")
 bam = snakemake.input.bam
 bedgraph = snakemake.output.bedgraph
+contigs = snakemake.params.get("contigs", [])
 
 # Get sample_id
 sample_id = snakemake.params.get("sample_id", None)
@@ -22,4 +24,13 @@ if not sample_id:
         sample_id = "Sample"
 
 # Run shell commands
-shell("bedtools genomecov {opt} -bg -ibam {bam} -trackopts 'type=bedGraph name={sample_id}' > {bedgraph} 2>> {snakemake.log}")
+if contigs:
+    # Only compute coverage for the contigs of the current shard. Other contigs are still listed in the BAM header
+    # and reported with a null coverage with -bga, so they also have to be filtered out from the output
+    if isinstance(contigs, str):
+        contigs = contigs.split()
+    contigs_str = " ".join(contigs)
+    shell("echo 'Computing coverage for contigs: {contigs_str}' >> {snakemake.log}")
+    shell("samtools view -@ {snakemake.threads} -u {bam} {contigs_str} 2>> {snakemake.log} | bedtools genomecov {opt} -bg -ibam stdin -trackopts 'type=bedGraph name={sample_id}' 2>> {snakemake.log} | awk -F '\\t' -v c='{contigs_str}' 'BEGIN{{split(c,a,\" \"); for(i in a) k[a[i]]=1}} /^track/ || ($1 in k)' > {bedgraph}")
+else:
+    shell("bedtools genomecov {opt} -bg -ibam {bam} -trackopts 'type=bedGraph name={sample_id}' > {bedgraph} 2>> {snakemake.log}")
@@ -2,10 +2,14 @@
 from snakemake.shell import shell
 import pandas as pd
 import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.count_merge import merge_samples, write_matrix, log_matrix
 
 # Wrapper info
 wrapper_name = "cufflinks_fpkm_merge"
-wrapper_version = "0.0.2"
+wrapper_version = "0.0.7"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
@@ -15,18 +19,17 @@ input_fpkm_genes = snakemake.input.get("fpkm_genes", None)
 input_fpkm_isoforms = snakemake.input.get("fpkm_isoforms", None)
 output_fpkm_genes = snakemake.output.get("fpkm_genes", None)
 output_fpkm_isoforms = snakemake.output.get("fpkm_isoforms", None)
+cache_dir = snakemake.params.get("cache_dir", None)
+compact = snakemake.params.get("compact", False)
 
-for input_fpkm, output_fpkm in ((input_fpkm_genes,output_fpkm_genes),(input_fpkm_isoforms,output_fpkm_isoforms)):
-    if input_fpkm and output_fpkm:
-        df = pd.DataFrame()
-        for c in input_fpkm:
-            sample_id = os.path.basename(c).rpartition(".")[0]
-            sample_df = pd.read_csv(c, sep="\t")
-            sample_df = sample_df[["tracking_id", "FPKM"]]
-            sample_df = sample_df.dropna()
-            sample_df = sample_df.rename(columns={"tracking_id":"id","FPKM":sample_id})
-            sample_df = sample_df.set_index("id")
-            df = df.join(sample_df, how='outer')
+def read_cufflinks (fn):
+    sample_df = pd.read_csv(fn, sep="\t", usecols=["tracking_id", "FPKM"])
+    sample_df = sample_df.dropna()
+    return sample_df.rename(columns={"tracking_id":"id"}).set_index("id")
 
-        df = df.fillna(0)
-        df.to_csv(output_fpkm, sep="\t")
+for name, input_fpkm, output_fpkm in (("genes",input_fpkm_genes,output_fpkm_genes),("isoforms",input_fpkm_isoforms,output_fpkm_isoforms)):
+    if input_fpkm and output_fpkm:
+        merge_cache_dir = os.path.join(cache_dir, name) if cache_dir else None
+        df = merge_samples(input_fpkm, read_cufflinks, ["FPKM"], snakemake.threads, merge_cache_dir, snakemake.log)["FPKM"]
+        write_matrix(df, output_fpkm, compact=compact)
+        log_matrix(df, f"{name} fpkm", snakemake.log)
@@ -0,0 +1,18 @@
+# Imports
+from os.path import join
+
+# Input and output data
+fastq = join(config["data_dir"], "ont_DNA", "reads.fastq.gz")
+batch_dir = "reads_batches"
+
+# Rules
+rule all:
+    input: [batch_dir]
+
+rule fastq_split:
+    input: fastq=fastq
+    output: batch_dir=directory(batch_dir)
+    threads: 2
+    params: opt="-l 1", batch_size=1000000
+    log: "fastq_split.log"
+    wrapper: "fastq_split"
@@ -0,0 +1,64 @@
+# Imports
+from snakemake.shell import shell
+import subprocess
+import os
+
+# Wrapper info
+wrapper_name = "fastq_split"
+wrapper_version = "0.0.2"
+author = "Adrien Leger"
+license = "MIT"
+shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
+
+# Shortcuts
+opt = snakemake.params.get("opt", "")
+fastq_input = snakemake.input.fastq
+batch_dir = snakemake.output.batch_dir
+batch_size = int(float(snakemake.params.get("batch_size", 1e9)))
+buffer_size = int(snakemake.params.get("buffer_size", 1024*1024))
+
+# Helper functions
+def open_batch (i):
+    """ Open a new batch file compressed with multi-threaded bgzip """
+    batch_fn = os.path.join(batch_dir, f"{i}.fastq.gz")
+    batch_fp = open(batch_fn, "wb")
+    proc = subprocess.Popen(f"bgzip -@ {snakemake.threads} {opt} -c", shell=True, stdin=subprocess.PIPE, stdout=batch_fp, bufsize=buffer_size)
+    return batch_fp, proc
+
+def close_batch (batch_fp, proc):
+    proc.stdin.close()
+    if proc.wait():
+        raise IOError (f"bgzip exited with non-zero status {proc.returncode}")
+    batch_fp.close()
+
+# Stream reads and start a new batch each time the number of bases reaches batch_size
+os.makedirs(batch_dir, exist_ok=True)
+cat_cmd = f"bgzip -@ {snakemake.threads} -dc" if fastq_input.endswith(".gz") else "cat"
+with subprocess.Popen(f"{cat_cmd} {fastq_input}", shell=True, stdout=subprocess.PIPE, bufsize=buffer_size) as input_proc, open(str(snakemake.log), "a") as log_fp:
+    input_fp = input_proc.stdout
+    n_batches = n_reads = n_bases = 0
+    batch_fp, proc = open_batch(n_batches)
+    while True:
+        header = input_fp.readline()
+        if not header:
+            break
+        seq = input_fp.readline()
+        proc.stdin.write(header+seq+input_fp.readline()+input_fp.readline())
+        n_reads += 1
+        n_bases += len(seq)-1
+        if n_bases >= batch_size:
+            log_fp.write(f"Batch {n_batches}: {n_reads} reads / {n_bases} bases\n")
+            close_batch(batch_fp, proc)
+            n_batches += 1
+            n_reads = n_bases = 0
+            batch_fp, proc = open_batch(n_batches)
+
+    # Write out last batch unless empty
+    close_batch(batch_fp, proc)
+    if n_reads or not n_batches:
+        log_fp.write(f"Batch {n_batches}: {n_reads} reads / {n_bases} bases\n")
+    else:
+        os.remove(os.path.join(batch_dir, f"{n_batches}.fastq.gz"))
+
+if input_proc.returncode:
+    raise IOError (f"Failed to read {fastq_input}")
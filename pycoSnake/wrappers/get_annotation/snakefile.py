@@ -10,10 +10,13 @@ gff3_output_1 = "ref_1.gff3"
 gtf_output_1 = "ref_1.gtf"
 gff3_output_2 = "ref_2.gff3"
 gtf_output_2 = "ref_2.gtf"
+gff3_output_3 = "ref_3.gff3"
+gtf_output_3 = "ref_3.gtf"
+index_output_3 = "ref_3_index"
 
 # Rules
 rule all:
-    input: [gff3_output_1, gtf_output_1, gff3_output_2, gtf_output_2]
+    input: [gff3_output_1, gtf_output_1, gff3_output_2, gtf_output_2, gff3_output_3, gtf_output_3, index_output_3]
 
 rule get_annotation_from_local:
     input: gff3=gff3_input
@@ -28,3 +31,10 @@ rule get_annotation_from_ftp:
     params: opt=""
     log: "get_annotation_from_ftp.log"
     wrapper: "get_annotation"
+
+rule get_annotation_index:
+    input: gff3=gff3_input
+    output: gff3=gff3_output_3, gtf=gtf_output_3, index_dir=directory(index_output_3)
+    params: opt=""
+    log: "get_annotation_index.log"
+    wrapper: "get_annotation"
@@ -1,30 +1,76 @@
 # Imports
 from snakemake.shell import shell
-import tempfile
+import subprocess
 import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.ref_cache import RefCache
+from pycoSnake.download import download_to_dir
+from pycoSnake.annotation_index import build_annotation_index
 
 # Wrapper info
 wrapper_name = "get_annotation"
-wrapper_version = "0.0.3"
+wrapper_version = "0.0.9"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Shortcuts
 opt = snakemake.params.get("opt", "")
-input_gff3 = str(snakemake.input.gff3)
+input_gff3 = str(snakemake.input.get("gff3", ""))
 output_gff3 = snakemake.output.gff3
 output_gtf = snakemake.output.gtf
+output_index_dir = snakemake.output.get("index_dir", "")
+cache_dir = snakemake.params.get("cache_dir", "")
+url = snakemake.params.get("url", "")
+download_parts = snakemake.params.get("download_parts", 4)
 outdir = os.path.dirname(os.path.abspath(output_gff3))
 
-with tempfile.TemporaryDirectory(dir=outdir) as temp_dir:
+output_d = {"gff3":output_gff3, "gtf":output_gtf}
+if output_index_dir:
+    output_d["index_dir"] = output_index_dir
 
-    # Gzipped files
-    if input_gff3.rpartition(".")[-1].lower()=="gz":
-        temp_gff3 = os.path.join(temp_dir, "temp.gff3")
-        shell("gunzip -c {input_gff3} > {temp_gff3}")
-        input_gff3 = temp_gff3
+# Link files from the shared reference cache if available or prepare them and save them in the cache
+with RefCache(cache_dir, output_d, input_gff3 or url, snakemake.log) as cache_hit:
+    if not cache_hit:
+        # Download remote file next to the output, resuming any partial download
+        if url:
+            input_gff3 = download_to_dir(url, outdir, n_parts=download_parts, log_fn=snakemake.log)
 
-    # Convert and clean annotations
-    shell("gffread {input_gff3} {opt} -F --keep-genes -o {output_gff3} &>> {snakemake.log}")
-    shell("gffread {input_gff3} {opt} -F --keep-genes -T -o {output_gtf} &>> {snakemake.log}")
+        # Decompress the input once and stream it to both conversions running concurrently through pipes
+        # A conversion exiting early breaks its pipe, so that the job fails instead of waiting for it
+        cat_cmd = "gzip -dc" if input_gff3.rpartition(".")[-1].lower()=="gz" else "cat"
+        with open(str(snakemake.log), "a") as log_fp:
+            cat_proc = subprocess.Popen(f"{cat_cmd} {input_gff3}", shell=True, stdout=subprocess.PIPE, stderr=log_fp)
+            gffread_procs = [
+                subprocess.Popen(f"gffread /dev/stdin {opt} -F --keep-genes -o {output_gff3}", shell=True, stdin=subprocess.PIPE, stdout=log_fp, stderr=log_fp),
+                subprocess.Popen(f"gffread /dev/stdin {opt} -F --keep-genes -T -o {output_gtf}", shell=True, stdin=subprocess.PIPE, stdout=log_fp, stderr=log_fp)]
+            broken_pipe = False
+            try:
+                for buf in iter(lambda: cat_proc.stdout.read(1024*1024), b""):
+                    for proc in gffread_procs:
+                        proc.stdin.write(buf)
+            except BrokenPipeError:
+                broken_pipe = True
+            finally:
+                for proc in gffread_procs:
+                    try:
+                        proc.stdin.close()
+                    except BrokenPipeError:
+                        broken_pipe = True
+                # Stop all the other processes if one of the conversions died
+                if broken_pipe:
+                    for proc in [cat_proc]+gffread_procs:
+                        proc.kill()
+                cat_proc.stdout.close()
+                for proc in [cat_proc]+gffread_procs:
+                    proc.wait()
+
+        if broken_pipe or any(proc.returncode for proc in [cat_proc]+gffread_procs):
+            status = ", ".join(f"{name}: {proc.returncode}" for name, proc in zip((cat_cmd, "gff3 gffread", "gtf gffread"), [cat_proc]+gffread_procs))
+            raise IOError (f"Annotation conversion failed (exit status {status})")
+
+        # Build binary interval index of genes, transcripts, exons and TSS from the cleaned annotation
+        if output_index_dir:
+            build_annotation_index(output_gff3, output_index_dir)
@@ -1,5 +1,12 @@
 # Imports
+import io
+import os
+import shutil
+import threading
+import http.server
+import socketserver
 from os.path import join
+from pycoSnake import download
 from snakemake.remote.FTP import RemoteProvider as FTPRemoteProvider
 from snakemake.remote.HTTP import RemoteProvider as HTTPRemoteProvider
 FTP = FTPRemoteProvider()
@@ -15,10 +22,21 @@ ref2_output = "ref2.fa"
 ref2_index = ref2_output+".fai"
 ref3_output = "ref3.fa"
 ref3_index = ref3_output+".fai"
+ref4_output = "ref4.fa"
+ref4_index = ref4_output+".fai"
+ref5_output = "ref5.fa"
+ref5_index = ref5_output+".fai"
+ref6_output = "ref6.fa.gz"
+ref6_index = ref6_output+".fai"
+ref6_gzi = ref6_output+".gzi"
+ref7_output = "ref7.fa"
+ref7_index = ref7_output+".fai"
+ref7_dropped = "ref7_dropped.tsv"
+download_report = "download_report.txt"
 
 # Rules
 rule all:
-    input: [ref1_output, ref1_index, ref2_output, ref2_index, ref3_output, ref3_index]
+    input: [ref1_output, ref1_index, ref2_output, ref2_index, ref3_output, ref3_index, ref4_output, ref4_index, ref5_output, ref5_index, ref6_output, ref6_index, ref6_gzi, ref7_output, ref7_index, ref7_dropped, download_report]
 
 rule get_genome_from_fa:
     input: ref=ref1_input
@@ -37,3 +55,179 @@ rule get_genome_from_ftp:
     output: ref=ref3_output, index=ref3_index
     log: "get_genome_from_ftp.log"
     wrapper: "get_genome"
+
+rule get_genome_cached:
+    input: ref=ref1_input
+    output: ref=ref4_output, index=ref4_index
+    log: "get_genome_cached.log"
+    params: cache_dir=join("ref_cache", "get_genome", "small_ref")
+    wrapper: "get_genome"
+
+rule get_genome_from_url:
+    output: ref=ref5_output, index=ref5_index
+    log: "get_genome_from_url.log"
+    params: url=ref3_input
+    wrapper: "get_genome"
+
+rule get_genome_bgzip:
+    input: ref=ref2_input
+    output: ref=ref6_output, index=ref6_index, gzi=ref6_gzi
+    log: "get_genome_bgzip.log"
+    threads: 2
+    params: line_width=80
+    wrapper: "get_genome"
+
+rule get_genome_filter:
+    input: ref=ref2_input
+    output: ref=ref7_output, index=ref7_index, dropped=ref7_dropped
+    log: "get_genome_filter.log"
+    params: exclude="Mito", min_length=300000
+    wrapper: "get_genome"
+
+rule get_genome_download:
+    input: ref=ref2_input
+    output: report=download_report
+    log: "get_genome_download.log"
+    run: test_download(input.ref, output.report, log[0])
+
+# Downloader tests against a local HTTP server supporting byte ranges
+class RangeHandler (http.server.SimpleHTTPRequestHandler):
+    """ Serve the files of the server root with optional HTTP Range support and simulated network failures """
+    def do_HEAD (self):
+        with self.server.lock:
+            fail = self.server.fail_head > 0
+            self.server.fail_head -= fail
+        if fail:
+            self.send_error(503)
+        else:
+            super().do_HEAD()
+
+    def send_head (self):
+        path = os.path.join(self.server.root, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        size = os.path.getsize(path)
+        start, end = 0, size-1
+        range_header = None if self.server.ignore_range else self.headers.get("Range")
+        if range_header:
+            start_str, _, end_str = range_header.partition("=")[2].partition("-")
+            start, end = int(start_str), int(end_str or end)
+        drop = False
+        if self.command == "GET":
+            with self.server.lock:
+                self.server.range_list.append((os.path.basename(path), start, end))
+                drop = self.server.drop_first > 0
+                self.server.drop_first -= drop
+        self.send_response(206 if range_header else 200)
+        self.send_header("Content-Length", str(end-start+1))
+        if not self.server.ignore_range:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        # Simulate a connection closed half way through the request
+        fp = open(path, "rb")
+        fp.seek(start)
+        data = fp.read((end-start+1)//2 if drop else end-start+1)
+        fp.close()
+        if drop:
+            self.close_connection = True
+        return io.BytesIO(data)
+
+    def log_message (self, *args):
+        pass
+
+class RangeServer (socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """ Local HTTP server running in a background thread while used as a context manager """
+    daemon_threads = True
+
+    def __init__ (self, root, fail_head=0, drop_first=0, ignore_range=False):
+        super().__init__(("127.0.0.1", 0), RangeHandler)
+        self.root = root
+        self.fail_head = fail_head
+        self.drop_first = drop_first
+        self.ignore_range = ignore_range
+        self.range_list = []
+        self.lock = threading.Lock()
+
+    def __enter__ (self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__ (self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def url (self, fn):
+        return f"http://127.0.0.1:{self.server_port}/{fn}"
+
+    def ranges (self, fn):
+        """ Byte ranges requested for fn in order """
+        return [(start, end) for range_fn, start, end in self.range_list if range_fn == fn]
+
+def test_download (ref_fn, report_fn, log_fn):
+    """ Check parallel ranges, resumed downloads, servers ignoring ranges and checksum verification """
+    root = os.path.abspath("download_server")
+    outdir = os.path.abspath("download_test")
+    for d in (root, outdir):
+        shutil.rmtree(d, ignore_errors=True)
+        os.makedirs(d)
+    fn = os.path.basename(ref_fn)
+    shutil.copy(ref_fn, root)
+    size = os.path.getsize(ref_fn)
+    expected = download.md5sum(ref_fn)
+    with open(os.path.join(root, "MD5SUM"), "w") as fp:
+        fp.write(f"{expected}  {fn}\n")
+    with open(ref_fn, "rb") as fp:
+        half = fp.read(size//2)
+    min_part_size = download.MIN_PART_SIZE
+    download.MIN_PART_SIZE = size//8
+    report = []
+    try:
+        # 4 parallel ranges all dropped half way and resumed, after a failed HEAD request
+        with RangeServer(root, fail_head=1, drop_first=4) as server:
+            dest = download.download_file(server.url(fn), os.path.join(outdir, "parallel.gz"), n_parts=4, retries=3, log_fn=log_fn)
+            assert download.md5sum(dest) == expected, "Invalid parallel download"
+            part_size = -(-size//4)
+            assert sorted(server.ranges(fn)[:4]) == [(i, min(i+part_size, size)-1) for i in range(0, size, part_size)], "Ranges not fetched in parallel"
+            assert len(server.ranges(fn)) == 8, "Dropped ranges not resumed"
+            with open(log_fn) as fp:
+                assert f"Attempt 1 failed for {server.url(fn)} (HTTP Error 503" in fp.read(), "HEAD request not retried"
+        report.append("parallel ranges, resume and HEAD retry: OK")
+
+        # Partial file left by a previous call is resumed
+        dest = os.path.join(outdir, "resumed.gz")
+        with open(dest+".part0", "wb") as fp:
+            fp.write(half)
+        with RangeServer(root) as server:
+            download.download_file(server.url(fn), dest, n_parts=1, retries=3, log_fn=log_fn)
+            assert download.md5sum(dest) == expected, "Invalid resumed download"
+            assert server.ranges(fn) == [(len(half), size-1)], "Partial file not resumed"
+        report.append("resume partial file: OK")
+
+        # Partial file is restarted from scratch if the server ignores ranges
+        dest = os.path.join(outdir, "no_range.gz")
+        with open(dest+".part0", "wb") as fp:
+            fp.write(half)
+        with RangeServer(root, ignore_range=True) as server:
+            download.download_file(server.url(fn), dest, n_parts=4, retries=3, log_fn=log_fn)
+            assert download.md5sum(dest) == expected, "Invalid download without ranges"
+            assert len(server.ranges(fn)) == 1, "Single request expected without ranges"
+        report.append("server ignoring ranges: OK")
+
+        # Download not matching the published checksum is removed
+        with open(os.path.join(root, "MD5SUM"), "w") as fp:
+            fp.write(f"{'0'*32}  {fn}\n")
+        dest = os.path.join(outdir, "mismatch.gz")
+        with RangeServer(root) as server:
+            try:
+                download.download_file(server.url(fn), dest, n_parts=4, retries=3, log_fn=log_fn)
+                raise AssertionError("Checksum mismatch not detected")
+            except download.DownloadError:
+                pass
+            assert not [i for i in os.listdir(outdir) if i.startswith("mismatch.gz")], "Invalid download not removed"
+        report.append("checksum mismatch: OK")
+    finally:
+        download.MIN_PART_SIZE = min_part_size
+        shutil.rmtree(root, ignore_errors=True)
+    with open(report_fn, "w") as fp:
+        fp.write("\n".join(report)+"\n")
@@ -1,24 +1,60 @@
 # Imports
 from snakemake.shell import shell
-from pyBioTools import Fasta
-from pyfaidx import Faidx
+import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.ref_cache import RefCache
+from pycoSnake.fasta import open_fasta, FastaWriter, ContigFilter
+from pycoSnake.download import download_to_dir
 
 # Wrapper info
 wrapper_name = "get_genome"
-wrapper_version = "0.0.3"
+wrapper_version = "0.0.8"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Shortcuts
-ref_input = str(snakemake.input.ref)
+ref_input = str(snakemake.input.get("ref", ""))
 ref_output = snakemake.output.ref
+index_output = snakemake.output.get("index", ref_output+".fai")
+gzi_output = snakemake.output.get("gzi", "")
+dropped_output = snakemake.output.get("dropped", "")
+line_width = snakemake.params.get("line_width", 60)
+include = snakemake.params.get("include", "")
+exclude = snakemake.params.get("exclude", "")
+min_length = snakemake.params.get("min_length", 0)
+primary_only = snakemake.params.get("primary_only", False)
+cache_dir = snakemake.params.get("cache_dir", "")
+url = snakemake.params.get("url", "")
+download_parts = snakemake.params.get("download_parts", 4)
 
-# Parse fasta file save transcript info in tabulated report and simplify transcript ids
-with open(ref_output, "w") as fa_out:
-    for rec in Fasta.Reader(ref_input):
-        fa_out.write(">{}\n{}\n".format(rec.short_name, rec.seq))
+output_d = {"ref":ref_output, "index":index_output}
+if gzi_output:
+    output_d["gzi"] = gzi_output
+if dropped_output:
+    output_d["dropped"] = dropped_output
 
-# Index fasta file
-with Faidx(ref_output) as fa_out:
-    fa_out.build_index()
+# Link files from the shared reference cache if available or prepare them and save them in the cache
+with RefCache(cache_dir, output_d, ref_input or url, snakemake.log) as cache_hit:
+    if not cache_hit:
+        # Download remote file next to the output, resuming any partial download
+        if url:
+            ref_input = download_to_dir(url, os.path.dirname(os.path.abspath(ref_output)), n_parts=download_parts, log_fn=snakemake.log)
+
+        # Stream fasta file line by line, select contigs, simplify sequence ids and rewrap sequences while building the fai index
+        # Output is compressed with bgzip if the output file name ends with .gz
+        with open_fasta(ref_input) as fa_in, FastaWriter(ref_output, index_output, line_width, gzi_output, snakemake.threads) as fa_out:
+            with ContigFilter(fa_out, include, exclude, min_length, primary_only) as contig_filter:
+                for line in fa_in:
+                    if line.startswith(b">"):
+                        contig_filter.add_record(line[1:].decode().strip())
+                    else:
+                        contig_filter.write(line.rstrip())
+
+        # Report dropped contigs
+        with open(str(snakemake.log), "a") as log_fp:
+            log_fp.write(f"Contigs kept: {len(contig_filter.kept_list)} / dropped: {len(contig_filter.dropped_list)}\n")
+        if dropped_output:
+            contig_filter.write_manifest(dropped_output)
@@ -1,70 +1,84 @@
 # Imports
 from snakemake.shell import shell
 from collections import OrderedDict
+from itertools import chain
+import re
 import pandas as pd
-from pyBioTools import Fasta
-from pyfaidx import Faidx
+import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.ref_cache import RefCache
+from pycoSnake.fasta import open_fasta, FastaWriter, ContigFilter
+from pycoSnake.download import download_to_dir
 
 # Wrapper info
 wrapper_name = "get_transcriptome"
-wrapper_version = "0.0.3"
+wrapper_version = "0.0.8"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Shortcuts
-ref_input = str(snakemake.input.ref)
+ref_input = str(snakemake.input.get("ref", ""))
 ref_output = snakemake.output.ref
 tsv_output = snakemake.output.get("tsv", "")
+index_output = snakemake.output.get("index", ref_output+".fai")
+dropped_output = snakemake.output.get("dropped", "")
+cache_dir = snakemake.params.get("cache_dir", "")
+url = snakemake.params.get("url", "")
+download_parts = snakemake.params.get("download_parts", 4)
+line_width = snakemake.params.get("line_width", 60)
+include = snakemake.params.get("include", "")
+exclude = snakemake.params.get("exclude", "")
+min_length = snakemake.params.get("min_length", 0)
+primary_only = snakemake.params.get("primary_only", False)
 
-# Parse fasta file save transcript info in tabulated report and simplify transcript ids
-l = []
-strand_dict = {"-1":"-","1":"+"}
-with open(ref_output, "w") as fa_out:
-
-    for rec in Fasta.Reader(ref_input):
-        fa_out.write(">{}\n{}\n".format(rec.short_name, rec.seq))
+output_d = {"ref":ref_output, "index":index_output}
+if tsv_output:
+    output_d["tsv"] = tsv_output
+if dropped_output:
+    output_d["dropped"] = dropped_output
 
-        # If required and possible extract all info from long sequence header
-        if tsv_output:
-            d = OrderedDict()
-            try:
-                desc = rec.long_name
-                tid,_,desc = desc.partition(" ")
-                d["transcript_id"]=tid
-                d["length"]=len(rec)
-                seqtype,_,desc = desc.partition(" ")
-                d["seqtype"]=seqtype
-                location,_,desc = desc.partition(" ")
-                location_split = location.split(":")
-                d["assembly_type"]=location_split[0]
-                d["assembly_id"]=location_split[1]
-                d["chrom_id"]=location_split[2]
-                d["start"]=location_split[3]
-                d["end"]=location_split[4]
-                d["strand"]=strand_dict.get(location_split[5], ".")
+# Link files from the shared reference cache if available or prepare them and save them in the cache
+with RefCache(cache_dir, output_d, ref_input or url, snakemake.log) as cache_hit:
+    if not cache_hit:
+        # Download remote file next to the output, resuming any partial download
+        if url:
+            ref_input = download_to_dir(url, os.path.dirname(os.path.abspath(ref_output)), n_parts=download_parts, log_fn=snakemake.log)
 
-                # Try to extract optional fields and store in dict
-                while desc:
-                    current, _,desc = desc.partition(" ")
-                    k,_,v = current.partition(":")
-                    if k == "description":
-                        break
+        # Stream fasta file, select transcripts, simplify transcript ids and build the fai index while writing
+        with open_fasta(ref_input) as fa_in, FastaWriter(ref_output, index_output, line_width) as fa_out:
+            with ContigFilter(fa_out, include, exclude, min_length, primary_only) as contig_filter:
+                for line in fa_in:
+                    if line.startswith(b">"):
+                        contig_filter.add_record(line[1:].decode().strip())
                     else:
-                        d[k]=v
-            # Skip exception silently
-            except Exception:
-                pass
-            # Save whatever was parsed
-            finally:
-                if d:
-                    l.append(d)
+                        contig_filter.write(line.rstrip())
 
-# Save tabulated report
-if tsv_output:
-    df = pd.DataFrame(l)
-    df.to_csv(tsv_output, sep="\t", index=False)
+        # Report dropped transcripts
+        with open(str(snakemake.log), "a") as log_fp:
+            log_fp.write(f"Transcripts kept: {len(contig_filter.kept_list)} / dropped: {len(contig_filter.dropped_list)}\n")
+        if dropped_output:
+            contig_filter.write_manifest(dropped_output)
+
+        # If required extract all info from the long sequence headers of selected transcripts in a vectorized way
+        # Ensembl headers: transcript_id seqtype coord_system:assembly:chrom:start:end:strand key:value... description:text
+        if tsv_output:
+            header_list, length_list = zip(*contig_filter.kept_list) if contig_filter.kept_list else ([], [])
+            headers = pd.Series(header_list, dtype=object)
+            df = headers.str.extract(
+                r"^(?P<transcript_id>\S+)(?:\s+(?P<seqtype>\S+))?"
+                r"(?:\s+(?P<assembly_type>[^:\s]+):(?P<assembly_id>[^:\s]*):(?P<chrom_id>[^:\s]+):(?P<start>[^:\s]+):(?P<end>[^:\s]+):(?P<strand>[^:\s]+)(?P<desc>.*)|\s.*)?$")
+            df.insert(1, "length", list(length_list))
+            strand = df["strand"]
+            df["strand"] = strand.map({"-1":"-", "1":"+"}).fillna(".").where(strand.notna())
+
+            # Extract optional key:value fields found before the free text description, one column at a time
+            fields = df.pop("desc").str.partition(" description:")[0]
+            key_list = OrderedDict.fromkeys(chain.from_iterable(fields.dropna().str.findall(r"(?:^|\s)([^\s:]+):")))
+            for key in key_list:
+                df[key] = fields.str.extract(r"(?:^|\s){}:(\S*)".format(re.escape(key)), expand=False)
 
-# Index fasta file
-with Faidx(ref_output) as fa_out:
-    fa_out.build_index()
+            # Save tabulated report
+            df.to_csv(tsv_output, sep="\t", index=False)
@@ -7,10 +7,14 @@ fastq = join(config["data_dir"], "ont_DNA", "reads.fastq.gz")
 index = "ref.mmi"
 bam = "reads.bam"
 bam_index = "reads.bam.bai"
+fused_bam = "reads_fused.bam"
+filtered_bam = "reads_fused_filtered.bam"
+stream_bam = "reads_stream.bam"
+stream_fastq = "reads_stream_filtered.fastq"
 
 # Rules
 rule all:
-    input: [index, bam, bam_index]
+    input: [index, bam, bam_index, filtered_bam, stream_bam]
 
 rule minimap2_index:
     input: ref=ref
@@ -29,3 +33,21 @@ rule minimap2_align:
     resources: mem_mb=1000
     log: "minimap2_align.log"
     wrapper: "minimap2_align"
+
+rule minimap2_align_fused_filter:
+    input: fastq=fastq, index=index
+    output: bam=fused_bam, bam_index=fused_bam+".bai", filtered_bam=filtered_bam, filtered_bam_index=filtered_bam+".bai"
+    threads: 2
+    params: opt="-x map-ont -L", min_mapq=10, min_align_len=1000, min_identity=0.7
+    resources: mem_mb=1000
+    log: "minimap2_align_fused_filter.log"
+    wrapper: "minimap2_align"
+
+rule minimap2_align_stream_filter:
+    input: fastq=fastq, index=index
+    output: bam=stream_bam, bam_index=stream_bam+".bai", fastq=stream_fastq
+    threads: 2
+    params: opt="-x map-ont -L", fastq_filter_opt="--min_len 1000 --min_qual 7"
+    resources: mem_mb=1000
+    log: "minimap2_align_stream_filter.log"
+    wrapper: "minimap2_align"
@@ -2,30 +2,98 @@
 from snakemake.shell import shell
 import tempfile
 import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.allocation import allocate_pipeline, get_path_size_mb
+from pycoSnake.fifo import fifo_guard, KILL_JOBS_ON_EXIT
 
 # Wrapper info
 wrapper_name = "minimap2_align"
-wrapper_version = "0.0.2"
+wrapper_version = "0.0.10"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Shortcuts
 opt = snakemake.params.get("opt", "")
-threads = snakemake.threads if snakemake.threads >= 4 else 4
-view_threads = sort_threads = threads//4
-align_threads = threads - (view_threads + sort_threads)
 outdir = os.path.dirname(os.path.abspath(snakemake.output.bam))
 fastq = snakemake.input.fastq
 index = snakemake.input.index
 bam = snakemake.output.bam
+filtered_bam = snakemake.output.get("filtered_bam", "")
+fastq_output = snakemake.output.get("fastq", "")
+fastq_filter_opt = snakemake.params.get("fastq_filter_opt", "")
+compression_level = snakemake.params.get("compression_level", None)
+level_opt = f"-l {compression_level}" if compression_level is not None else ""
+min_mapq = snakemake.params.get("min_mapq", 0)
+min_align_len = snakemake.params.get("min_align_len", 0)
+min_identity = snakemake.params.get("min_identity", 0)
+skip_unmapped = snakemake.params.get("skip_unmapped", True)
+skip_secondary = snakemake.params.get("skip_secondary", True)
+skip_supplementary = snakemake.params.get("skip_supplementary", True)
 
 # Run shell commands
-shell("echo '#### MINIMAP2 + SAMTOOLS VIEW & SORT LOG ####' >> {snakemake.log}")
+# Split granted threads and memory between minimap2 and samtools. minimap2 memory is dominated by the index
+# In streaming mode one thread is left for the read filter and compression of the saved reads shares the view threads
+threads = max(snakemake.threads-1, 1) if fastq_output else snakemake.threads
+alloc = allocate_pipeline(threads, snakemake.resources.get("mem_mb", 0), get_path_size_mb(index)+1000,
+    view=bool(filtered_bam) or fastq_output.endswith(".gz"), n_sorts=2 if filtered_bam else 1, log_fn=snakemake.log)
+align_threads, view_threads, sort_threads, sort_mem_mb = alloc.values()
 
+shell("echo '#### MINIMAP2 + SAMTOOLS SORT LOG ####' >> {snakemake.log}")
+
+# Processes reading or writing a named pipe run in a subshell guarded with fifo_guard, so that a failure before the
+# pipe is opened is reported by wait instead of the job hanging
 with tempfile.TemporaryDirectory(dir=outdir) as temp_dir:
-    shell("minimap2 -t {align_threads} -a -L {opt} {index} {fastq} 2>> {snakemake.log}|\
-        samtools view -@ {view_threads} -bh 2>> {snakemake.log} |\
-        samtools sort -@ {sort_threads} -T {temp_dir} -O bam > {bam} 2>> {snakemake.log}")
+    unfiltered_temp = os.path.join(temp_dir, "unfiltered")
+
+    # Streaming mode: raw reads are filtered with pyBioTools into a named pipe, saved with tee for the downstream rules
+    # and aligned as they come, so that filtering overlaps with alignment and the filtered reads are not read back
+    if fastq_output:
+        fastq_fifo = os.path.join(temp_dir, "filtered.fastq")
+        os.mkfifo(fastq_fifo)
+        shell("pyBioTools --version >> {snakemake.log}")
+        stream_start = f"({fifo_guard(fastq_fifo)} pyBioTools Fastq Filter -i {fastq} -o {fastq_fifo} {fastq_filter_opt} --verbose &>> {snakemake.log}) & fastq_filter_pid=$!;"
+        stream_end = "; wait $fastq_filter_pid"
+        # Compress the saved copy with bgzip through a second named pipe if required
+        if fastq_output.endswith(".gz"):
+            fastq_copy_fifo = os.path.join(temp_dir, "filtered_copy.fastq")
+            os.mkfifo(fastq_copy_fifo)
+            stream_start += f" ({fifo_guard(fastq_copy_fifo)} bgzip -@ {max(view_threads, 1)} {level_opt} -c < {fastq_copy_fifo} > {fastq_output}) & bgzip_pid=$!; tee {fastq_copy_fifo} < {fastq_fifo} |"
+            stream_end += "; wait $bgzip_pid"
+        else:
+            stream_start += f" tee {fastq_output} < {fastq_fifo} |"
+        reads = "-"
+    else:
+        stream_start = stream_end = ""
+        reads = fastq
+
+    if not filtered_bam:
+        shell("{KILL_JOBS_ON_EXIT} {stream_start} minimap2 -t {align_threads} -a -L {opt} {index} {reads} 2>> {snakemake.log}|\
+            samtools sort -@ {sort_threads} -m {sort_mem_mb}M -T {unfiltered_temp} -O bam --write-index -o {bam}##idx##{bam}.bai 2>> {snakemake.log} {stream_end}")
+
+    # Fused filtering: the SAM stream is duplicated with tee and filtered with samtools view before its own sort
+    else:
+        flag = (4 if skip_unmapped else 0) + (256 if skip_secondary else 0) + (2048 if skip_supplementary else 0)
+        expr_list = []
+        if min_align_len:
+            expr_list.append(f"rlen >= {min_align_len}")
+        if min_identity:
+            expr_list.append(f"[NM] <= {round(1-min_identity, 6)}*rlen")
+        expr = " && ".join(expr_list)
+        if expr and not skip_unmapped:
+            expr = f"flag.unmap || ({expr})"
+        filter_opt = f"-F {flag} -q {min_mapq}" + (f" -e '{expr}'" if expr else "")
+        with open(str(snakemake.log), "a") as log_fp:
+            log_fp.write(f"Fused alignment filter: {filter_opt}\n")
 
-shell("samtools index {bam}")
+        filtered_fifo = os.path.join(temp_dir, "filtered.fifo")
+        filtered_temp = os.path.join(temp_dir, "filtered")
+        os.mkfifo(filtered_fifo)
+        filter_guard = fifo_guard(filtered_fifo)
+        shell("{KILL_JOBS_ON_EXIT} ({filter_guard} samtools view -@ {view_threads} -u {filter_opt} {filtered_fifo} 2>> {snakemake.log} |\
+            samtools sort -@ {sort_threads} -m {sort_mem_mb}M -T {filtered_temp} -O bam --write-index -o {filtered_bam}##idx##{filtered_bam}.bai 2>> {snakemake.log}) & filter_pid=$!; \
+            {stream_start} minimap2 -t {align_threads} -a -L {opt} {index} {reads} 2>> {snakemake.log} | tee {filtered_fifo} |\
+            samtools sort -@ {sort_threads} -m {sort_mem_mb}M -T {unfiltered_temp} -O bam --write-index -o {bam}##idx##{bam}.bai 2>> {snakemake.log}; \
+            wait $filter_pid {stream_end}")
@@ -4,10 +4,11 @@ from os.path import join
 # Input and output data
 ref = join(config["data_dir"], "reference", "ref.fa")
 index = "index/ref.mmi"
+index_cached = "index_cached/ref.mmi"
 
 # Rules
 rule all:
-    input: [index]
+    input: [index, index_cached]
 
 rule minimap2_index:
     input: ref=ref
@@ -17,3 +18,12 @@ rule minimap2_index:
     resources: mem_mb=1000
     log: "minimap2_index.log"
     wrapper: "minimap2_index"
+
+rule minimap2_index_cached:
+    input: ref=ref
+    output: index=index_cached
+    threads: 2
+    params: opt="", cache_dir="index_cache"
+    resources: mem_mb=1000
+    log: "minimap2_index_cached.log"
+    wrapper: "minimap2_index"
@@ -10,10 +10,11 @@ ref = join(config["data_dir"], "reference", "small_ref.fa")
 output_fastq = "reads.fastq"
 index = output_fastq+".index"
 tsv = "nanopolish_call_methylation.tsv"
+tsv_gz = "nanopolish_call_methylation.tsv.gz"
 
 # Rules
 rule all:
-    input: [output_fastq, index, tsv]
+    input: [output_fastq, index, tsv, tsv_gz]
 
 # Copy and extract fastq
 rule pbt_fastq_filter:
@@ -41,3 +42,13 @@ rule nanopolish_call_methylation:
     resources: mem_mb=1000
     log: "nanopolish_call_methylation.log"
     wrapper: "nanopolish_call_methylation"
+
+# Index call_methylation with BGZF compressed output
+rule nanopolish_call_methylation_gz:
+    input: fastq=output_fastq, bam=bam, ref=ref, index=index
+    output: tsv=tsv_gz
+    threads: 4
+    params: opt=""
+    resources: mem_mb=1000
+    log: "nanopolish_call_methylation_gz.log"
+    wrapper: "nanopolish_call_methylation"
@@ -1,19 +1,35 @@
 # Imports
 from snakemake.shell import shell
+import tempfile
+import os
 
 # Wrapper info
 wrapper_name = "nanopolish_call_methylation"
-wrapper_version = "0.0.3"
+wrapper_version = "0.0.6"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Shortcuts
 opt = snakemake.params.get("opt", "")
+sort = snakemake.params.get("sort", False)
+compression_level = snakemake.params.get("compression_level", None)
 fastq = snakemake.input.fastq
 bam = snakemake.input.bam
 ref = snakemake.input.ref
 tsv = snakemake.output.tsv
+outdir = os.path.dirname(os.path.abspath(tsv))
+
+# Optional compression and coordinate sorting commands
+# BGZF compress on the fly if required so that chunks can later be concatenated without decompression
+level_opt = f"-l {compression_level}" if compression_level is not None else ""
+compress_cmd = f"| bgzip -@ {snakemake.threads} {level_opt} -c" if tsv.endswith(".gz") else ""
 
 # Run shell commands
-shell("nanopolish call-methylation {opt} -t {snakemake.threads} -r {fastq} -b {bam} -g {ref} > {tsv} 2>> {snakemake.log}")
+with tempfile.TemporaryDirectory(dir=outdir) as temp_dir:
+    # Sort calls by chromosome and start position, but keep the header line on top
+    if sort:
+        sort_cmd = f"| {{ IFS= read -r header; printf '%s\\n' \"$header\"; LC_ALL=C sort -t $'\\t' -k1,1 -k3,3n --parallel={snakemake.threads} -T {temp_dir}; }}"
+    else:
+        sort_cmd = ""
+    shell("nanopolish call-methylation {opt} -t {snakemake.threads} -r {fastq} -b {bam} -g {ref} 2>> {snakemake.log} {sort_cmd} {compress_cmd} > {tsv} 2>> {snakemake.log}")
@@ -10,10 +10,12 @@ input_nc2 = join(config["data_dir"], "ont_DNA", "sniffles_1.vcf")
 output_1 = "merged_1.txt"
 output_2 = "merged_2.txt.gz"
 output_3 = "merged_3.txt.gz"
+output_4 = "merged_4.tsv.gz"
+output_4_index = "merged_4.tsv.gz.tbi"
 
 # Rules
 rule all:
-    input: [output_1, output_2, output_3]
+    input: [output_1, output_2, output_3, output_4, output_4_index]
 
 rule nanopolish_concat_1:
     input: tsv_list=[input_gz1, input_gz2]
@@ -24,11 +26,21 @@ rule nanopolish_concat_1:
 rule nanopolish_concat_2:
     input: tsv_list=[input_nc1, input_nc2]
     output: tsv=output_2
+    threads: 2
     log: "nanopolish_concat_2.log"
     wrapper: "nanopolish_concat"
 
 rule nanopolish_concat_3:
     input: tsv_list=[input_gz1, input_gz2, input_nc1, input_nc2]
     output: tsv=output_3
+    threads: 4
+    params: buffer_size=4096
     log: "nanopolish_concat_3.log"
     wrapper: "nanopolish_concat"
+
+rule nanopolish_concat_4_sorted:
+    input: tsv_list=[input_gz1, input_gz2]
+    output: tsv=output_4, tsv_index=output_4_index
+    threads: 2
+    log: "nanopolish_concat_4.log"
+    wrapper: "nanopolish_concat"
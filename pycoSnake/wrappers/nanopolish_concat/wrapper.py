@@ -1,31 +1,173 @@
 # Imports
 import gzip
+import heapq
+import os
+import shutil
+import struct
+import subprocess
+import zlib
 
 # Wrapper info
 wrapper_name = "nanopolish_concat"
-wrapper_version = "0.0.1"
+wrapper_version = "0.0.5"
 author = "Adrien Leger"
 license = "MIT"
 
 # Shortcuts
+opt = snakemake.params.get("opt", "")
+buffer_size = int(snakemake.params.get("buffer_size", 1024*1024))
 input_tsv_list = snakemake.input.tsv_list
 output_tsv = snakemake.output.tsv
+output_tsv_index = snakemake.output.get("tsv_index", "")
+
+# BGZF format constants
+BGZF_HEADER = b"\x1f\x8b\x08\x04"
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# Helper functions
+def is_bgzf (fn):
+    """Check if the first block of a file is a BGZF block"""
+    with open(fn, "rb") as fp:
+        header = fp.read(16)
+    return len(header) == 16 and header[:4] == BGZF_HEADER and header[12:14] == b"BC"
+
+def read_bgzf_block (fp):
+    """Read the next raw BGZF block from fp and return the block and its decompressed content"""
+    header = fp.read(18)
+    if not header:
+        return b"", b""
+    bsize = struct.unpack("<H", header[16:18])[0]
+    block = header + fp.read(bsize-17)
+    data = zlib.decompress(block[18:-8], -15)
+    return block, data
+
+def make_bgzf_block (data, level=6):
+    """Compress data in a single BGZF block (data must be smaller than 64KB)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = BGZF_HEADER + b"\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" + struct.pack("<H", len(cdata)+25)
+    return header + cdata + struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+
+def copy_bytes (input_fp, output_fp, length, buffer_size):
+    """Copy length bytes from input_fp to output_fp by fixed size buffers"""
+    while length > 0:
+        buf = input_fp.read(min(buffer_size, length))
+        if not buf:
+            break
+        output_fp.write(buf)
+        length -= len(buf)
+
+def coord_key (line):
+    """Sorting key for nanopolish lines (chromosome, start)"""
+    chrom, _, start, _ = line.split(b"\t", 3)
+    return (chrom, int(start))
+
+def open_bgzip (fn, threads, opt, log_fp):
+    """Open a multi-threaded bgzip process writing to fn"""
+    log_fp.write(f'Compressing output with bgzip using {threads} threads\n')
+    log_fp.flush()
+    output_fp = open(fn, "wb")
+    bgzip_proc = subprocess.Popen(
+        f"bgzip -@ {threads} {opt} -c",
+        shell=True, stdin=subprocess.PIPE, stdout=output_fp, stderr=log_fp)
+    return output_fp, bgzip_proc
 
 with open (str(snakemake.log), "w") as log_fp:
     log_fp.write(f'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}\n')
 
-    # Concatenate and manage gzip compression
-    open_fun, open_mode = (gzip.open, "wt") if output_tsv.endswith(".gz") else (open, "w")
-
-    with open_fun(output_tsv, open_mode) as output_fp:
-        first = True
-        for input_tsv in input_tsv_list:
-            log_fp.write(f'Reading file {input_tsv}\n')
-            open_fun, open_mode = (gzip.open, "rt") if input_tsv.endswith(".gz") else (open, "r")
-            with open_fun(input_tsv, open_mode) as input_fp:
-                if not first:
-                    # flush header if not first file
-                    _ = input_fp.readline()
-                else:
-                    first=False
-                output_fp.write(input_fp.read())
+    # Sorted path: k-way merge of coordinate sorted inputs into a bgzipped file indexed with tabix
+    if output_tsv_index:
+        if not output_tsv.endswith(".gz"):
+            raise ValueError ("A tabix index can only be generated for a gzipped output file")
+        log_fp.write('Merging coordinate sorted input files\n')
+        output_fp, bgzip_proc = open_bgzip(output_tsv, snakemake.threads, opt, log_fp)
+        input_fp_list = []
+        try:
+            header = None
+            for input_tsv in input_tsv_list:
+                log_fp.write(f'Reading file {input_tsv}\n')
+                open_fun = gzip.open if input_tsv.endswith(".gz") else open
+                input_fp = open_fun(input_tsv, "rb")
+                input_fp_list.append(input_fp)
+                # Keep the first header only
+                line = input_fp.readline()
+                if header is None:
+                    header = line
+                    bgzip_proc.stdin.write(header)
+            bgzip_proc.stdin.writelines(heapq.merge(*input_fp_list, key=coord_key))
+        finally:
+            for input_fp in input_fp_list:
+                input_fp.close()
+            bgzip_proc.stdin.close()
+            bgzip_proc.wait()
+            output_fp.close()
+
+        if bgzip_proc.returncode != 0:
+            raise IOError (f"bgzip exited with non-zero status {bgzip_proc.returncode}")
+
+        # Index with tabix on the start and end columns so that multi-CpG groups overlapping a region are found
+        log_fp.write('Indexing output file with tabix\n')
+        log_fp.flush()
+        subprocess.run(f"tabix -f -0 -S 1 -s 1 -b 3 -e 4 {output_tsv}", shell=True, check=True, stderr=log_fp)
+        if os.path.abspath(output_tsv+".tbi") != os.path.abspath(output_tsv_index):
+            shutil.move(output_tsv+".tbi", output_tsv_index)
+
+    # Fast path: all inputs are BGZF and output is compressed = concatenate compressed blocks without decompressing the payload
+    elif output_tsv.endswith(".gz") and all(is_bgzf(fn) for fn in input_tsv_list):
+        log_fp.write('All input files are BGZF compressed. Concatenating compressed blocks\n')
+        with open(output_tsv, "wb") as output_fp:
+            first = True
+            for input_tsv in input_tsv_list:
+                log_fp.write(f'Reading file {input_tsv}\n')
+                # Do not copy intermediate EOF markers
+                file_len = os.path.getsize(input_tsv)
+                with open(input_tsv, "rb") as input_fp:
+                    input_fp.seek(max(0, file_len-len(BGZF_EOF)))
+                    if input_fp.read() == BGZF_EOF:
+                        file_len -= len(BGZF_EOF)
+                    input_fp.seek(0)
+
+                    # flush header if not first file. Only the blocks containing the header are recompressed
+                    if not first:
+                        data = b""
+                        while b"\n" not in data and input_fp.tell() < file_len:
+                            _, block_data = read_bgzf_block(input_fp)
+                            data += block_data
+                        data = data.partition(b"\n")[2]
+                        if data:
+                            output_fp.write(make_bgzf_block(data))
+                    else:
+                        first=False
+                    copy_bytes(input_fp, output_fp, file_len-input_fp.tell(), buffer_size)
+            output_fp.write(BGZF_EOF)
+
+    # Streaming path: decompress inputs and stream through multi-threaded bgzip if compression is required
+    else:
+        if output_tsv.endswith(".gz"):
+            output_fp, bgzip_proc = open_bgzip(output_tsv, snakemake.threads, opt, log_fp)
+            write_fp = bgzip_proc.stdin
+        else:
+            output_fp = write_fp = open(output_tsv, "wb")
+            bgzip_proc = None
+
+        # Concatenate files by fixed size buffers and skip the header of all but the first file
+        try:
+            first = True
+            for input_tsv in input_tsv_list:
+                log_fp.write(f'Reading file {input_tsv}\n')
+                open_fun = gzip.open if input_tsv.endswith(".gz") else open
+                with open_fun(input_tsv, "rb") as input_fp:
+                    if not first:
+                        # flush header if not first file
+                        _ = input_fp.readline()
+                    else:
+                        first=False
+                    shutil.copyfileobj(input_fp, write_fp, buffer_size)
+        finally:
+            write_fp.close()
+            if bgzip_proc:
+                bgzip_proc.wait()
+                output_fp.close()
+
+        if bgzip_proc and bgzip_proc.returncode != 0:
+            raise IOError (f"bgzip exited with non-zero status {bgzip_proc.returncode}")
@@ -2,30 +2,32 @@
 from snakemake.shell import shell
 import tempfile
 import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.allocation import allocate_pipeline
 
 # Wrapper info
 wrapper_name = "ngmlr"
-wrapper_version = "0.0.2"
+wrapper_version = "0.0.5"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Shortcuts
 opt = snakemake.params.get("opt", "")
-threads = snakemake.threads if snakemake.threads >= 4 else 4
-view_threads = sort_threads = threads//4
-align_threads = threads - (view_threads + sort_threads)
 outdir = os.path.dirname(os.path.abspath(snakemake.output.bam))
 fastq = snakemake.input.fastq
 ref = snakemake.input.ref
 bam = snakemake.output.bam
 
 # Run shell commands
+# Split granted threads and memory between ngmlr and samtools sort
+alloc = allocate_pipeline(snakemake.threads, snakemake.resources.get("mem_mb", 0), view=False, log_fn=snakemake.log)
+align_threads, _, sort_threads, sort_mem_mb = alloc.values()
+
 shell("echo '#### NGMLR + SAMTOOLS LOG ####' >> {snakemake.log}")
 
 with tempfile.TemporaryDirectory(dir=outdir) as temp_dir:
     shell("ngmlr -t {align_threads} {opt} -r {ref} -q {fastq} 2>> {snakemake.log}|\
-        samtools view -@ {view_threads}  -bh 2>> {snakemake.log} |\
-        samtools sort -@ {sort_threads} -T {temp_dir} -O bam > {bam} 2>> {snakemake.log}")
-
-shell("samtools index {bam}")
+        samtools sort -@ {sort_threads} -m {sort_mem_mb}M -T {temp_dir} -O bam --write-index -o {bam}##idx##{bam}.bai 2>> {snakemake.log}")
@@ -8,10 +8,13 @@ bam_illumina_input = join(config["data_dir"], "illumina_RNA", "reads_1.bam")
 chunks = [0,1,2,3]
 bam_ont_output = expand("ont_reads_split_{c}.bam",c=chunks)
 bam_illumina_output = expand("illumina_reads_split_{c}.bam",c=chunks)
+bam_ont_coverage_output = expand("ont_reads_coverage_split_{c}.bam",c=chunks)
+bam_ont_coverage_index = expand("ont_reads_coverage_split_{c}.bam.bai",c=chunks)
+bam_ont_dir_output = "ont_reads_dir_split"
 
 # Rules
 rule all:
-    input: [bam_ont_output, bam_illumina_output]
+    input: [bam_ont_output, bam_illumina_output, bam_ont_coverage_output, bam_ont_coverage_index, bam_ont_dir_output]
 
 rule alignment_split_ont:
     input: bam=bam_ont_input
@@ -24,3 +27,19 @@ rule alignment_split_illumina:
     output: bam=bam_illumina_output
     log: "alignment_split_illumina.log"
     wrapper: "pbt_alignment_split"
+
+rule alignment_split_ont_coverage:
+    input: bam=bam_ont_input, bam_index=bam_ont_input+".bai"
+    output: bam=bam_ont_coverage_output, bam_index=bam_ont_coverage_index
+    threads: 2
+    params: split_mode="coverage"
+    log: "alignment_split_ont_coverage.log"
+    wrapper: "pbt_alignment_split"
+
+rule alignment_split_ont_dir:
+    input: bam=bam_ont_input, bam_index=bam_ont_input+".bai"
+    output: bam_dir=directory(bam_ont_dir_output)
+    threads: 2
+    params: split_mode="coverage", chunk_size=1000000, max_chunks=10
+    log: "alignment_split_ont_dir.log"
+    wrapper: "pbt_alignment_split"
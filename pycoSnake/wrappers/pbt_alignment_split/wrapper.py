@@ -1,18 +1,176 @@
 # Imports
 from snakemake.shell import shell
+import struct
+import os
+import pysam
 
 # Wrapper info
 wrapper_name = "pbt_alignment_split"
-wrapper_version = "0.0.3"
+wrapper_version = "0.0.6"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Shortcuts
 opt = snakemake.params.get("opt", "")
+split_mode = snakemake.params.get("split_mode", "reads")
 bam_input = snakemake.input.bam
-bam_output = snakemake.output.bam
+bam_index_input = snakemake.input.get("bam_index", bam_input+".bai")
+bam_output = snakemake.output.get("bam", [])
+bam_index_output = snakemake.output.get("bam_index", [])
+bam_dir = snakemake.output.get("bam_dir", "")
+n_chunks = int(snakemake.params.get("n_chunks", 4))
+chunk_size = int(float(snakemake.params.get("chunk_size", 0)))
+max_chunks = int(snakemake.params.get("max_chunks", 0))
+
+# Helper functions
+def read_bai_weights (bai_fn, ref_len_list):
+    """
+    Parse a BAI index and estimate the amount of data in each 16kb window of each reference from the
+    compressed file offsets stored in the linear index. BAM records mostly contain bases and qualities,
+    so the compressed size of a window is a good proxy for the number of aligned bases it contains.
+    Return a list of (window_start, window_end, weight) lists, one per reference
+    """
+    with open(bai_fn, "rb") as fp:
+        if fp.read(4) != b"BAI\1":
+            raise ValueError (f"{bai_fn} is not a valid BAI index file")
+        n_ref = struct.unpack("<i", fp.read(4))[0]
+        ref_list = []
+        for ref_len in ref_len_list[:n_ref]:
+            # Parse bins and keep reference end offset and number of mapped reads from the pseudo bin
+            ref_end_offset = n_mapped = 0
+            n_bin = struct.unpack("<i", fp.read(4))[0]
+            for _ in range(n_bin):
+                bin_id, n_chunk = struct.unpack("<Ii", fp.read(8))
+                chunks = struct.unpack(f"<{2*n_chunk}Q", fp.read(16*n_chunk))
+                if bin_id == 37450:
+                    ref_end_offset = chunks[1]>>16
+                    n_mapped = chunks[2]
+            # Parse linear index and forward fill empty windows
+            n_intv = struct.unpack("<i", fp.read(4))[0]
+            offsets = []
+            last_offset = 0
+            for offset in struct.unpack(f"<{n_intv}Q", fp.read(8*n_intv)):
+                last_offset = max(offset>>16, last_offset)
+                offsets.append(last_offset)
+            offsets.append(max(ref_end_offset, last_offset))
+            # Compute window weights
+            windows = []
+            for i in range(n_intv):
+                start = i*16384
+                end = min((i+1)*16384, ref_len)
+                windows.append([start, end, offsets[i+1]-offsets[i]])
+            # Fall back to uniform coverage if the BAM is too small to be resolved by compressed offsets
+            if n_mapped and not sum(w[2] for w in windows):
+                for w in windows:
+                    w[2] = n_mapped*(w[1]-w[0])/ref_len
+            ref_list.append(windows)
+    return ref_list
+
+def split_regions (ref_name_list, ref_weight_list, n_chunks):
+    """Group consecutive windows into n_chunks lists of regions with similar total weights"""
+    total = sum(w[2] for windows in ref_weight_list for w in windows)
+    chunk_regions = [[] for _ in range(n_chunks)]
+    cum_weight = 0
+    for ref_name, windows in zip(ref_name_list, ref_weight_list):
+        for start, end, weight in windows:
+            chunk = min(int(cum_weight*n_chunks/total), n_chunks-1) if total else 0
+            cum_weight += weight
+            # Extend last region if contiguous or start a new one
+            regions = chunk_regions[chunk]
+            if regions and regions[-1][0] == ref_name and regions[-1][2] == start:
+                regions[-1][2] = end
+            else:
+                regions.append([ref_name, start, end])
+    return chunk_regions
+
+def estimate_mapped_bases (bam_fn, bam_index_fn, n_sample=10000, n_windows=10):
+    """
+    Estimate the number of mapped bases from the number of mapped reads per reference in the index (samtools idxstats)
+    and the mean alignment length of a sample of reads. The sample is spread across references in proportion to their
+    number of mapped reads and across n_windows evenly spaced windows of each reference
+    """
+    with pysam.AlignmentFile(bam_fn, "rb", index_filename=bam_index_fn) as bam:
+        stat_list = [stat for stat in bam.get_index_statistics() if stat.mapped]
+        total_mapped = sum(stat.mapped for stat in stat_list)
+        ref_len_d = {}
+        for stat in stat_list:
+            ref_len = bam.get_reference_length(stat.contig)
+            n_ref_sample = max(n_sample*stat.mapped//total_mapped, 1)
+            n_ref_windows = min(n_windows, n_ref_sample)
+            len_list = []
+            for i in range(n_ref_windows):
+                start = i*ref_len//n_ref_windows
+                end = (i+1)*ref_len//n_ref_windows
+                n = 0
+                for read in bam.fetch(stat.contig, start, end):
+                    # Skip reads starting in the previous window
+                    if read.reference_start < start or read.is_unmapped or read.is_secondary or read.is_supplementary:
+                        continue
+                    len_list.append(read.query_alignment_length)
+                    n += 1
+                    if n == n_ref_sample//n_ref_windows:
+                        break
+            ref_len_d[stat.contig] = len_list
+
+    # Use the overall mean length for references without primary alignments in the sample
+    all_len_list = [l for len_list in ref_len_d.values() for l in len_list]
+    if not all_len_list:
+        return 0
+    mean_len = sum(all_len_list)/len(all_len_list)
+    mapped_bases = 0
+    for stat in stat_list:
+        len_list = ref_len_d[stat.contig]
+        mapped_bases += stat.mapped*(sum(len_list)/len(len_list) if len_list else mean_len)
+    return int(mapped_bases)
+
+# Define output files from the sample size if an output directory is given instead of a list of files
+if bam_dir:
+    if chunk_size:
+        mapped_bases = estimate_mapped_bases(bam_input, bam_index_input)
+        n_chunks = -(-mapped_bases//chunk_size)
+        shell("echo 'Estimated mapped bases: {mapped_bases}' >> {snakemake.log}")
+    if max_chunks:
+        n_chunks = min(n_chunks, max_chunks)
+    n_chunks = max(n_chunks, 1)
+    shell("echo 'Number of chunks: {n_chunks}' >> {snakemake.log}")
+    os.makedirs(bam_dir, exist_ok=True)
+    bam_output = [os.path.join(bam_dir, f"{i}.bam") for i in range(n_chunks)]
+    bam_index_output = [fn+".bai" for fn in bam_output]
 
 # Run shell command
-shell("pyBioTools --version >> {snakemake.log}")
-shell("pyBioTools Alignment Split {opt} -i {bam_input} -l {bam_output} --verbose &>> {snakemake.log}")
+if split_mode == "reads":
+    shell("pyBioTools --version >> {snakemake.log}")
+    shell("pyBioTools Alignment Split {opt} -i {bam_input} -l {bam_output} --verbose &>> {snakemake.log}")
+
+    # Make sure that chunks are indexed in directory mode
+    if bam_dir:
+        for bam_fn, bam_index_fn in zip(bam_output, bam_index_output):
+            if not os.path.isfile(bam_index_fn):
+                pysam.index(bam_fn, bam_index_fn)
+
+elif split_mode == "coverage":
+    n_chunks = len(bam_output)
+    with pysam.AlignmentFile(bam_input, "rb", index_filename=bam_index_input) as bam, open(str(snakemake.log), "a") as log_fp:
+        # Estimate data per window from the index and define balanced genomic regions
+        ref_weight_list = read_bai_weights(bam_index_input, bam.lengths)
+        chunk_regions = split_regions(bam.references, ref_weight_list, n_chunks)
+
+        # Write out reads starting in each region, so that reads overlapping region boundaries are only written once
+        for i, (regions, bam_fn) in enumerate(zip(chunk_regions, bam_output)):
+            log_fp.write(f"Chunk {i}: {' '.join('{}:{}-{}'.format(*r) for r in regions)}\n")
+            n_reads = 0
+            with pysam.AlignmentFile(bam_fn, "wb", template=bam, threads=snakemake.threads) as bam_out:
+                for ref_name, start, end in regions:
+                    for read in bam.fetch(ref_name, start, end):
+                        if read.reference_start >= start:
+                            bam_out.write(read)
+                            n_reads += 1
+            log_fp.write(f"\tReads written to {bam_fn}: {n_reads}\n")
+
+    # Index chunks
+    for bam_fn, bam_index_fn in zip(bam_output, bam_index_output):
+        pysam.index(bam_fn, bam_index_fn)
+
+else:
+    raise ValueError (f"Invalid split_mode `{split_mode}`. Valid values are `reads` and `coverage`")
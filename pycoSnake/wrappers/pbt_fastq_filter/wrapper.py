@@ -3,16 +3,24 @@ from snakemake.shell import shell
 
 # Wrapper info
 wrapper_name = "pbt_fastq_filter"
-wrapper_version = "0.0.3"
+wrapper_version = "0.0.7"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Get optional args if unavailable
 opt = snakemake.params.get("opt", "")
+compression_level = snakemake.params.get("compression_level", None)
+level_opt = f"-l {compression_level}" if compression_level is not None else ""
 fastq_input = snakemake.input.fastq
 fastq_output = snakemake.output.fastq
 
 # Run shell command
 shell("pyBioTools --version >> {snakemake.log}")
-shell("pyBioTools Fastq Filter -i {fastq_input} -o {fastq_output} {opt} --verbose &>> {snakemake.log}")
+if fastq_output.endswith(".gz"):
+    # Compress with fast multi-threaded bgzip rather than with pyBioTools single threaded gzip. pyBioTools only logs to
+    # stderr so its stdout carries the reads, and pipefail reports a failure of either side
+    shell("pyBioTools Fastq Filter -i {fastq_input} -o /dev/stdout {opt} --verbose 2>> {snakemake.log} |\
+        bgzip -@ {snakemake.threads} {level_opt} -c > {fastq_output}")
+else:
+    shell("pyBioTools Fastq Filter -i {fastq_input} -o {fastq_output} {opt} --verbose &>> {snakemake.log}")
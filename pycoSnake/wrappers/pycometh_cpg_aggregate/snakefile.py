@@ -9,10 +9,12 @@ input_tsv_2 = join(config["data_dir"], "ont_DNA", "nanopolish_sample_2.tsv.gz")
 output_tsv_2 = "cpg_aggregate_2.tsv.gz"
 output_bed_2 = "cpg_aggregate_2.bed"
 output_bed_index_2 = "cpg_aggregate_2.bed.idx"
+output_tsv_3 = "cpg_aggregate_3.tsv.gz"
+output_bed_3 = "cpg_aggregate_3.bed"
 
 # Rules
 rule all:
-    input: [output_tsv_1, output_tsv_2, output_bed_2, output_bed_index_2]
+    input: [output_tsv_1, output_tsv_2, output_bed_2, output_bed_index_2, output_tsv_3, output_bed_3]
 
 rule pycometh_cpg_aggregate_1:
     input: tsv=input_tsv_1, ref=ref
@@ -28,3 +30,13 @@ rule pycometh_cpg_aggregate_2:
         opt="--min_depth 5 --min_llr 1",
         sample_id="Test"
     wrapper: "pycometh_cpg_aggregate"
+
+rule pycometh_cpg_aggregate_3_shard:
+    input: tsv=input_tsv_2, ref=ref
+    output: tsv=output_tsv_3, bed=output_bed_3
+    log: "pycometh_cpg_aggregate_3.log"
+    params:
+        opt="--min_depth 5 --min_llr 1",
+        sample_id="Test",
+        contigs=["I", "II"]
+    wrapper: "pycometh_cpg_aggregate"
@@ -1,10 +1,11 @@
 # Imports
 from snakemake.shell import shell
 import os
+import tempfile
 
 # Wrapper info
 wrapper_name = "pycometh_cpg_aggregate"
-wrapper_version = "0.0.5"
+wrapper_version = "0.0.6"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
@@ -16,6 +17,7 @@ ref = snakemake.input.ref
 output_tsv = snakemake.output.get("tsv", "")
 output_bed = snakemake.output.get("bed", "")
 output_bed_index = snakemake.output.get("bed_index", "")
+contigs = snakemake.params.get("contigs", [])
 
 # Define conditional IO
 output = ""
@@ -29,7 +31,21 @@ if output_tsv:
 
 # Run shell command
 shell("pycoMeth --version >> {snakemake.log}")
-shell(f"pycoMeth CpG_Aggregate {opt} -i {input_tsv} -f {ref} {output} 2>> {snakemake.log}")
+with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_tsv or output_bed))) as temp_dir:
+    # Restrict input to the contigs of the current shard, with tabix if the input is indexed
+    if contigs:
+        if isinstance(contigs, str):
+            contigs = contigs.split()
+        contigs_str = " ".join(contigs)
+        shard_tsv = os.path.join(temp_dir, "shard.tsv")
+        shell("echo 'Extracting calls for contigs: {contigs_str}' >> {snakemake.log}")
+        if os.path.isfile(input_tsv+".tbi"):
+            shell("tabix -h {input_tsv} {contigs_str} > {shard_tsv} 2>> {snakemake.log}")
+        else:
+            cat_cmd = "gzip -dc" if input_tsv.endswith(".gz") else "cat"
+            shell("{cat_cmd} {input_tsv} | awk -F '\\t' -v c='{contigs_str}' 'BEGIN{{split(c,a,\" \"); for(i in a) k[a[i]]=1}} NR==1 || ($1 in k)' > {shard_tsv} 2>> {snakemake.log}")
+        input_tsv = shard_tsv
+    shell(f"pycoMeth CpG_Aggregate {opt} -i {input_tsv} -f {ref} {output} 2>> {snakemake.log}")
 
 # Optional Indexing with igv
 if output_bed_index and output_bed_index.endswith(".idx") and output_bed and output_bed.endswith(".bed"):
@@ -4,7 +4,7 @@ import os
 
 # Wrapper info
 wrapper_name = "pycoqc"
-wrapper_version = "0.0.2"
+wrapper_version = "0.0.3"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
@@ -12,6 +12,8 @@ shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {lic
 # Shortcuts
 opt = snakemake.params.get("opt", "")
 seqsum = snakemake.input.seqsum
+if not isinstance(seqsum, str):
+    seqsum = " ".join(seqsum)
 bam = snakemake.input.get("bam", None)
 html = snakemake.output.get("html", None)
 json = snakemake.output.get("json", None)
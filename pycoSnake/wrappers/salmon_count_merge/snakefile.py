@@ -6,13 +6,30 @@ from glob import glob
 input_counts = sorted(glob(join(config["data_dir"], "illumina_RNA", "reads_*_salmon_quant.tsv")))
 output_counts = "salmom_quant_counts.tsv"
 output_tpm = "salmom_quant_tpm.tsv"
+output_counts_parquet = "salmom_quant_counts.parquet"
+output_tpm_feather = "salmom_quant_tpm.feather"
+output_counts_incremental = "salmom_quant_counts_incremental.tsv"
 
 # Rules
 rule all:
-    input: [output_counts, output_tpm]
+    input: [output_counts, output_tpm, output_counts_parquet, output_tpm_feather, output_counts_incremental]
 
 rule salmon_count_merge:
     input: counts=input_counts
     output: counts=output_counts, tpm=output_tpm
     log: "salmon_count_merge.log"
     wrapper: "salmon_count_merge"
+
+rule salmon_count_merge_columnar:
+    input: counts=input_counts
+    output: counts=output_counts_parquet, tpm=output_tpm_feather
+    threads: 2
+    log: "salmon_count_merge_columnar.log"
+    wrapper: "salmon_count_merge"
+
+rule salmon_count_merge_incremental:
+    input: counts=input_counts
+    output: counts=output_counts_incremental
+    params: cache_dir="merge_cache"
+    log: "salmon_count_merge_incremental.log"
+    wrapper: "salmon_count_merge"
@@ -1,19 +1,32 @@
 # Imports
 from snakemake.shell import shell
 import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.ref_cache import RefCache, get_content_key, get_cache_entry
 
 # Wrapper info
 wrapper_name = "salmon_index"
-wrapper_version = "0.0.2"
+wrapper_version = "0.0.4"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Shortcuts
 opt = snakemake.params.get("opt", "")
+cache_dir = snakemake.params.get("cache_dir", "")
 ref = snakemake.input.ref
 index_dir = snakemake.output.index_dir
 os.makedirs(index_dir, exist_ok=True)
 
+# Find index in the shared index cache from the transcriptome content, salmon version and options
+entry_dir = ""
+if cache_dir:
+    version = shell("salmon --version 2>&1", read=True).decode().strip()
+    entry_dir = get_cache_entry(cache_dir, wrapper_name, get_content_key([ref], wrapper_name, opt, version))
+
 # Run shell command
-shell("salmon index {opt} -p {snakemake.threads} -t {ref} -i {index_dir} &>> {snakemake.log}")
+with RefCache(entry_dir, {"index_dir":index_dir}, ref, snakemake.log) as cache_hit:
+    if not cache_hit:
+        shell("salmon index {opt} -p {snakemake.threads} -t {ref} -i {index_dir} &>> {snakemake.log}")
@@ -0,0 +1,26 @@
+# Imports
+from os.path import join
+
+# Input and output data
+bam_1 = join(config["data_dir"], "ont_DNA", "ngmlr_sim_read_2.bam")
+bam_2 = join(config["data_dir"], "ont_DNA", "ngmlr_sim_read_3.bam")
+bam_3 = join(config["data_dir"], "ont_DNA", "reads.bam")
+bam_output = "merged.bam"
+bam_link_output = "linked.bam"
+
+# Rules
+rule all:
+    input: [bam_output, bam_link_output]
+
+rule samtools_merge:
+    input: bam=[bam_1, bam_2]
+    output: bam=bam_output, bam_index=bam_output+".bai"
+    threads: 2
+    log: "samtools_merge.log"
+    wrapper: "samtools_merge"
+
+rule samtools_merge_single:
+    input: bam=[bam_3], bam_index=[bam_3+".bai"]
+    output: bam=bam_link_output, bam_index=bam_link_output+".bai"
+    log: "samtools_merge_single.log"
+    wrapper: "samtools_merge"
@@ -0,0 +1,54 @@
+# Imports
+from snakemake.shell import shell
+import tempfile
+import shutil
+import os
+
+# Wrapper info
+wrapper_name = "samtools_merge"
+wrapper_version = "0.0.2"
+author = "Adrien Leger"
+license = "MIT"
+shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
+
+# Shortcuts
+opt = snakemake.params.get("opt", "")
+outdir = os.path.dirname(os.path.abspath(snakemake.output[0]))
+
+# Helper functions
+def link_file (src, dest):
+    """ Hard link src to dest or copy it if on a different file system """
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+# Merge each named output BAM from the sorted BAM files listed in the input with the same name and write its index
+# in the same pass. Index files are given as outputs named after the BAM output with an _index suffix. A single
+# input file is linked to the output together with its index if given in the input with the same _index suffix
+with tempfile.TemporaryDirectory(dir=outdir) as temp_dir:
+    for name, bam_output in snakemake.output.items():
+        if name.endswith("_index"):
+            continue
+        bam_list = snakemake.input.get(name)
+        if isinstance(bam_list, str):
+            bam_list = [bam_list]
+        bam_index_list = snakemake.input.get(f"{name}_index", [])
+        if isinstance(bam_index_list, str):
+            bam_index_list = [bam_index_list]
+        bam_index_output = snakemake.output.get(f"{name}_index", bam_output+".bai")
+
+        if len(bam_list) == 1 and len(bam_index_list) == 1:
+            shell("echo '#### LINK {name} ####' >> {snakemake.log}")
+            link_file(bam_list[0], bam_output)
+            link_file(bam_index_list[0], bam_index_output)
+            continue
+
+        bam_list_fn = os.path.join(temp_dir, f"{name}.txt")
+        with open(bam_list_fn, "w") as fp:
+            fp.write("\n".join(bam_list)+"\n")
+        n_files = len(bam_list)
+        shell("echo '#### SAMTOOLS MERGE {name} ({n_files} files) ####' >> {snakemake.log}")
+        shell("samtools merge {opt} -@ {snakemake.threads} -c -p -f --write-index -b {bam_list_fn} {bam_output}##idx##{bam_index_output} &>> {snakemake.log}")
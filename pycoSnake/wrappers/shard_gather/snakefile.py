@@ -0,0 +1,26 @@
+# Imports
+from os.path import join
+
+# Input and output data
+input_tsv_1 = join(config["data_dir"], "ont_DNA", "Yeast_sample_1_CpG_aggregate.tsv.gz")
+input_tsv_2 = join(config["data_dir"], "ont_DNA", "Yeast_sample_2_CpG_aggregate.tsv.gz")
+
+output_1 = "gathered_1.tsv"
+output_2 = "gathered_2.tsv.gz"
+
+# Rules
+rule all:
+    input: [output_1, output_2]
+
+rule shard_gather_1:
+    input: tsv=[input_tsv_1, input_tsv_2]
+    output: tsv=output_1
+    log: "shard_gather_1.log"
+    wrapper: "shard_gather"
+
+rule shard_gather_2:
+    input: tsv=[input_tsv_1, input_tsv_2]
+    output: tsv=output_2
+    threads: 2
+    log: "shard_gather_2.log"
+    wrapper: "shard_gather"
@@ -0,0 +1,63 @@
+# Imports
+from snakemake.shell import shell
+import gzip
+import shutil
+import subprocess
+
+# Wrapper info
+wrapper_name = "shard_gather"
+wrapper_version = "0.0.1"
+author = "Adrien Leger"
+license = "MIT"
+shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
+
+# Shortcuts
+opt = snakemake.params.get("opt", "")
+header_lines = int(snakemake.params.get("header_lines", 1))
+buffer_size = int(snakemake.params.get("buffer_size", 1024*1024))
+output_bed = snakemake.output.get("bed", "")
+output_bed_index = snakemake.output.get("bed_index", "")
+
+# Gather each named output from the shard files listed in the input with the same name, in the given order
+with open (str(snakemake.log), "a") as log_fp:
+    for name, output_fn in snakemake.output.items():
+        if name == "bed_index":
+            continue
+        input_list = snakemake.input.get(name)
+        if isinstance(input_list, str):
+            input_list = [input_list]
+        log_fp.write(f"Gathering {len(input_list)} shards into {output_fn}\n")
+        log_fp.flush()
+
+        # Compress with multi-threaded bgzip if required
+        if output_fn.endswith(".gz"):
+            output_fp = open(output_fn, "wb")
+            bgzip_proc = subprocess.Popen(
+                f"bgzip -@ {snakemake.threads} {opt} -c",
+                shell=True, stdin=subprocess.PIPE, stdout=output_fp, stderr=log_fp)
+            write_fp = bgzip_proc.stdin
+        else:
+            output_fp = write_fp = open(output_fn, "wb")
+            bgzip_proc = None
+
+        # Concatenate shards and only keep the header lines of the first one
+        try:
+            for i, input_fn in enumerate(input_list):
+                open_fun = gzip.open if input_fn.endswith(".gz") else open
+                with open_fun(input_fn, "rb") as input_fp:
+                    if i:
+                        for _ in range(header_lines):
+                            input_fp.readline()
+                    shutil.copyfileobj(input_fp, write_fp, buffer_size)
+        finally:
+            write_fp.close()
+            if bgzip_proc:
+                bgzip_proc.wait()
+                output_fp.close()
+
+        if bgzip_proc and bgzip_proc.returncode != 0:
+            raise IOError (f"bgzip exited with non-zero status {bgzip_proc.returncode}")
+
+# Optional Indexing with igv
+if output_bed_index and output_bed_index.endswith(".idx") and output_bed and output_bed.endswith(".bed"):
+    shell("igvtools index {output_bed} &>> {snakemake.log}")
@@ -2,10 +2,14 @@
 from snakemake.shell import shell
 import tempfile
 import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.allocation import allocate_star_sort
 
 # Wrapper info
 wrapper_name = "star_align"
-wrapper_version = "0.0.3"
+wrapper_version = "0.0.6"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
@@ -29,13 +33,20 @@ elif fastq1.endswith(".gz") or fastq2.endswith(".gz"):
 else:
     unzip_option = ""
 
+# Give STAR the memory left after loading the index for sorting, unless set by the user
+sort_option = ""
+if not "--limitBAMsortRAM" in opt:
+    sort_mem = allocate_star_sort(snakemake.resources.get("mem_mb", 0), index_dir, log_fn=snakemake.log)
+    if sort_mem:
+        sort_option = f"--limitBAMsortRAM {sort_mem}"
+
 # Run shell command
 outdir = os.path.dirname(os.path.abspath(snakemake.output[0]))
 with tempfile.TemporaryDirectory(dir=outdir) as temp_dir:
     temp_dir = temp_dir+os.path.sep
 
     # Run shell command
-    shell("STAR {opt} {unzip_option}\
+    shell("STAR {opt} {unzip_option} {sort_option}\
         --runMode alignReads\
         --outSAMtype BAM SortedByCoordinate\
         --runThreadN {snakemake.threads}\
@@ -55,7 +66,7 @@ with tempfile.TemporaryDirectory(dir=outdir) as temp_dir:
         temp_file = os.path.join(temp_dir, "Aligned.sortedByCoord.out.bam")
         shell("mv {temp_file} {bam}")
         if bam_index:
-            shell("samtools index {bam}")
+            shell("samtools index -@ {snakemake.threads} {bam}")
     if star_log:
         temp_file = os.path.join(temp_dir, "Log.final.out")
         shell("mv {temp_file} {star_log}")
@@ -8,10 +8,11 @@ unstranded_counts_1 = "star_unstranded_counts_1.tsv"
 positive_counts_1 = "star_positive_counts_1.tsv"
 unstranded_counts_2 = "star_unstranded_counts_2.tsv"
 negative_counts_2 = "star_negative_counts_1.tsv"
+store_3 = "star_counts_3.h5"
 
 # Rules
 rule all:
-    input: [unstranded_counts_1, positive_counts_1, unstranded_counts_2, negative_counts_2]
+    input: [unstranded_counts_1, positive_counts_1, unstranded_counts_2, negative_counts_2, store_3]
 
 rule star_count_merge_1:
     input: counts=counts
@@ -24,3 +25,10 @@ rule star_count_merge_2:
     output: unstranded_counts=unstranded_counts_2, negative_counts=negative_counts_2
     log: "star_count_merge_2.log"
     wrapper: "star_count_merge"
+
+rule star_count_merge_3:
+    input: counts=counts
+    output: store=store_3
+    threads: 2
+    log: "star_count_merge_3.log"
+    wrapper: "star_count_merge"
@@ -2,27 +2,46 @@
 from snakemake.shell import shell
 import pandas as pd
 import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.count_merge import merge_samples, write_matrix, log_matrix, compact_dtypes
 
 # Wrapper info
 wrapper_name = "star_count_merge"
-wrapper_version = "0.0.3"
+wrapper_version = "0.0.9"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Shortcuts
 input_counts = snakemake.input.counts
-unstranded_counts = snakemake.output.get("unstranded_counts", None)
-positive_counts = snakemake.output.get("positive_counts", None)
-negative_counts = snakemake.output.get("negative_counts", None)
+output_store = snakemake.output.get("store", None)
+cache_dir = snakemake.params.get("cache_dir", None)
+compact = snakemake.params.get("compact", False)
+output_d = {
+    "unstranded": snakemake.output.get("unstranded_counts", None),
+    "positive": snakemake.output.get("positive_counts", None),
+    "negative": snakemake.output.get("negative_counts", None)}
 
-for col_num, output_counts in ((1,unstranded_counts),(2,positive_counts),(3,negative_counts)):
-    if output_counts:
-        df = pd.DataFrame()
-        for c in input_counts:
-            sample_id = os.path.basename(c).rpartition(".")[0]
-            sample_df = pd.read_csv(c, sep="\t", names=["gene_id", sample_id], index_col=0, usecols=[0,col_num])
-            sample_df = sample_df.dropna()
-            df = df.join(sample_df, how='outer')
-        df = df.fillna(0)
-        df.to_csv(output_counts, sep="\t")
+# Only parse the strand columns required
+col_list = [col for col, output_counts in output_d.items() if output_counts or output_store]
+
+def read_star (fn):
+    return pd.read_csv(fn, sep="\t", names=["gene_id", "unstranded", "positive", "negative"], index_col=0, usecols=["gene_id"]+col_list)
+
+# Read all new samples once and fill all the strand matrices from the same parsed data
+matrix_d = merge_samples(input_counts, read_star, col_list, snakemake.threads, cache_dir, snakemake.log)
+
+# Write out
+store = pd.HDFStore(output_store, mode="w", complevel=5, complib="blosc") if output_store else None
+try:
+    for col, df in matrix_d.items():
+        if output_d[col]:
+            write_matrix(df, output_d[col], compact=compact)
+        if store is not None:
+            store.put(col, compact_dtypes(df) if compact else df, format="fixed")
+        log_matrix(df, f"{col} counts", snakemake.log)
+finally:
+    if store is not None:
+        store.close()
@@ -3,35 +3,48 @@ from snakemake.shell import shell
 from pyfaidx import Fasta
 from math import log2
 import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.ref_cache import RefCache, get_content_key, get_cache_entry
 
 # Wrapper info
 wrapper_name = "star_index"
-wrapper_version = "0.0.4"
+wrapper_version = "0.0.6"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
 
 # Shortcuts
 opt = snakemake.params.get("opt", "")
+cache_dir = snakemake.params.get("cache_dir", "")
 ref = snakemake.input.ref
 annotation = snakemake.input.annotation
 index_dir = os.path.abspath(snakemake.output.index_dir)+"/"
 os.makedirs(index_dir, exist_ok=True)
 
-# Comput index base depending on genome length
-genome_len = 0
-with Fasta(ref) as fa:
-    for seq in fa:
-        genome_len+=len(seq)
-indexNbases = min(14, int(log2(genome_len)/2) - 1)
+# Find index in the shared index cache from the genome and annotation content, STAR version and options
+entry_dir = ""
+if cache_dir:
+    version = shell("STAR --version", read=True).decode().strip()
+    entry_dir = get_cache_entry(cache_dir, wrapper_name, get_content_key([ref, annotation], wrapper_name, opt, version))
 
-# Run shell command
-shell("STAR {opt} \
-    --genomeSAindexNbases {indexNbases} \
-    --runMode genomeGenerate \
-    --runThreadN {snakemake.threads} \
-    --genomeDir {index_dir} \
-    --genomeFastaFiles {ref} \
-    --sjdbGTFfile {annotation} \
-    --outFileNamePrefix {index_dir} \
-    &>> {snakemake.log}")
+with RefCache(entry_dir, {"index_dir":index_dir}, ref, snakemake.log) as cache_hit:
+    if not cache_hit:
+        # Comput index base depending on genome length
+        genome_len = 0
+        with Fasta(ref) as fa:
+            for seq in fa:
+                genome_len+=len(seq)
+        indexNbases = min(14, int(log2(genome_len)/2) - 1)
+
+        # Run shell command
+        shell("STAR {opt} \
+            --genomeSAindexNbases {indexNbases} \
+            --runMode genomeGenerate \
+            --runThreadN {snakemake.threads} \
+            --genomeDir {index_dir} \
+            --genomeFastaFiles {ref} \
+            --sjdbGTFfile {annotation} \
+            --outFileNamePrefix {index_dir} \
+            &>> {snakemake.log}")
@@ -8,10 +8,11 @@ output_counts_1 = "featurecounts_merge_counts_1.tsv"
 output_tpm_2 = "featurecounts_merge_tpm_2.tsv"
 output_counts_3 = "featurecounts_merge_counts_3.tsv"
 output_tpm_3 = "featurecounts_merge_tpm_3.tsv"
+output_counts_4 = "featurecounts_merge_counts_4.npz"
 
 # Rules
 rule all:
-    input: [output_counts_1, output_tpm_2, output_counts_3, output_tpm_3]
+    input: [output_counts_1, output_tpm_2, output_counts_3, output_tpm_3, output_counts_4]
 
 rule subread_featurecounts_merge_1:
     input: counts=input_counts
@@ -30,3 +31,9 @@ rule subread_featurecounts_merge_3:
     output: counts=output_counts_3, tpm=output_tpm_3
     log: "subread_featurecounts_merge_3.log"
     wrapper: "subread_featurecounts_merge"
+
+rule subread_featurecounts_merge_4:
+    input: counts=input_counts
+    output: counts=output_counts_4
+    log: "subread_featurecounts_merge_4.log"
+    wrapper: "subread_featurecounts_merge"
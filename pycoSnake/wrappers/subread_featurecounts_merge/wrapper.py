@@ -2,10 +2,14 @@
 from snakemake.shell import shell
 import pandas as pd
 import os
+import sys
+# pycoSnake helpers are imported from the package shipping this wrapper, which is not installed in the wrapper env
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from pycoSnake.count_merge import merge_samples, write_matrix, log_matrix
 
 # Wrapper info
 wrapper_name = "subread_featurecounts_merge"
-wrapper_version = "0.0.2"
+wrapper_version = "0.0.7"
 author = "Adrien Leger"
 license = "MIT"
 shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {license}' > {snakemake.log}")
@@ -14,34 +18,25 @@ shell("echo 'Wrapper {wrapper_name} v{wrapper_version} / {author} / Licence {lic
 input_counts = snakemake.input.counts
 output_counts = snakemake.output.get("counts", None)
 output_tpm = snakemake.output.get("tpm", None)
+cache_dir = snakemake.params.get("cache_dir", None)
+compact = snakemake.params.get("compact", False)
+output_d = {"counts":output_counts, "tpm":output_tpm}
 
-df_counts = pd.DataFrame()
-df_tpm = pd.DataFrame()
-
-for c in input_counts:
-    sample_id = os.path.basename(c).rpartition(".")[0]
-    sample_df = pd.read_csv(c, sep="\t", skiprows=2, names=["gene_id","length","counts"], usecols=[0,5,6], index_col=0)
+def read_featurecounts (fn):
+    sample_df = pd.read_csv(fn, sep="\t", skiprows=2, names=["gene_id","length","counts"], usecols=[0,5,6], index_col=0)
     sample_df = sample_df[sample_df["counts"] > 0]
-    sample_df.dropna(inplace=True)
-    sample_df.sort_index(inplace=True)
-
-    # Aggregate counts
-    if output_counts:
-        counts = sample_df["counts"]
-        counts.name = sample_id
-        df_counts = df_counts.join(counts, how="outer")
-
-    # Calculate and aggregate tpm
+    sample_df = sample_df.dropna()
+    # Calculate tpm
     if output_tpm:
         rpk = sample_df["counts"]*(sample_df["length"]/1000)
-        tmp = sample_df["TMP"] = rpk/(rpk.sum()/1000000)
-        tmp.name = sample_id
-        df_tpm = df_tpm.join(tmp, how="outer")
+        sample_df["tpm"] = rpk/(rpk.sum()/1000000)
+    return sample_df
+
+# Read all new samples once and build matrices in a single concatenation
+col_list = [col for col, output_fn in output_d.items() if output_fn]
+matrix_d = merge_samples(input_counts, read_featurecounts, col_list, snakemake.threads, cache_dir, snakemake.log)
 
 # Write out
-if output_counts:
-    df_counts = df_counts.fillna(0)
-    df_counts.to_csv(output_counts, sep="\t")
-if output_tpm:
-    df_tpm = df_tpm.fillna(0)
-    df_tpm.to_csv(output_tpm, sep="\t")
+for col, df in matrix_d.items():
+    write_matrix(df, output_d[col], compact=compact)
+    log_matrix(df, col, snakemake.log)